@@ -1,60 +1,49 @@
 import logging
-import threading
 import asyncio
 
 from TTSObsWebsocket import start_websocket_server
 from TwitchBot import run_Twitch_Bot
 from YouTubeBot import run_YouTube_Bot
+from BotLoop import bot_loop
+from ChatWorkers import chat_workers
+from Supervisor import supervisor
+from TTSWorker import tts_worker
+from HelixClient import helix
+from BotStats import log_stats
 from config import process_settings
 
-# Global shutdown event
-shutdown_event = threading.Event()
-
-def start_twitch_bot():
-    try:
-        run_Twitch_Bot()
-    except Exception as e:
-        logging.error(f"Twitch bot crashed: {e}")
-        shutdown_event.set()
-
-def start_youtube_bot():
-    try:
-        run_YouTube_Bot()
-    except Exception as e:
-        logging.error(f"YouTube bot crashed: {e}")
-        shutdown_event.set()
-
 async def main():
     settings = process_settings("settings.json")
     logging.info(f"Settings: {settings}")
 
-    threads = []
+    # Everything runs on this one loop; blocking work goes to bot_loop's executor
+    loop = asyncio.get_running_loop()
+    bot_loop.attach(loop)
+    helix.start(loop)
+    chat_workers.start(loop)
 
+    # Each part is restarted on its own if it crashes or stops sending heartbeats
     if settings.get("Twitch_Bot", False):
-        t = threading.Thread(target=start_twitch_bot, name="TwitchBot")
-        t.start()
-        threads.append(t)
+        supervisor.add("TwitchBot", run_Twitch_Bot)
 
     if settings.get("YouTube_Bot", False):
-        y = threading.Thread(target=start_youtube_bot, name="YouTubeBot")
-        y.start()
-        threads.append(y)
+        supervisor.add("YouTubeBot", run_YouTube_Bot)
 
-    websocket_task = None
     if settings.get("OBS_Browser_Source", False) or settings.get("Sanity_Bar", False):
-        websocket_task = asyncio.create_task(start_websocket_server())
+        supervisor.add("WebSocketServer", start_websocket_server)
+
+    supervisor.add("TTSWorker", tts_worker.watch)
 
+    stats_task = asyncio.create_task(log_stats(), name="StatsLog")
     try:
-        # Monitor threads and wait
-        while not shutdown_event.is_set():
-            await asyncio.sleep(1)
+        await supervisor.run()
     except asyncio.CancelledError:
         logging.info("Shutting down asyncio tasks...")
     finally:
-        if websocket_task:
-            websocket_task.cancel()
-        for t in threads:
-            t.join(timeout=5)
+        stats_task.cancel()
+        await chat_workers.stop()
+        await helix.close()
+        bot_loop.blocking.shutdown(wait=False)
         logging.info("All bots shut down.")
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from config import load_settings
+
+settings = load_settings("settings.json")
+Bot_Blocking_Workers = int(settings.get("Bot_Blocking_Workers", 8))
+
+
+def running_on(loop):
+    """True when called from a task or callback running on `loop`, so it can be used directly instead of via call_soon_threadsafe."""
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+class BotLoop:
+    """
+    The bot's one long-lived event loop, owned by Bot.main(). Chat handling, viewer lookups,
+    commands and WebSocket broadcasts all run as tasks on it. spawn() can be called from any
+    thread (the IRC reader, the TTS playback thread) to start a task there, and blocking calls
+    (sound effects, sync HTTP clients, auth) go to a fixed-size executor via run_blocking() instead
+    of a new thread each.
+    """
+
+    def __init__(self, blocking_workers=Bot_Blocking_Workers):
+        self.loop = None
+        self.blocking = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix="BotBlocking")
+        self.spawned = 0
+        self.failed = 0
+        self._tasks = set()
+
+    def attach(self, loop):
+        self.loop = loop
+        loop.set_default_executor(self.blocking)
+
+    def spawn(self, coroutine):
+        """
+        Runs a coroutine as a task on the bot loop, from any thread. Errors are logged. Without a
+        running bot loop (standalone scripts) the coroutine is run to completion right here.
+        """
+        if self.loop is None or self.loop.is_closed():
+            try:
+                asyncio.run(coroutine)
+            except Exception as e:
+                logging.error(f"Error in {getattr(coroutine, '__qualname__', coroutine)}: {e}")
+            return
+
+        self.spawned += 1
+        if running_on(self.loop):
+            self._track(self.loop.create_task(coroutine))
+        else:
+            self.loop.call_soon_threadsafe(lambda: self._track(self.loop.create_task(coroutine)))
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Runs a blocking call on the sized executor and awaits its result."""
+        return await asyncio.get_running_loop().run_in_executor(self.blocking, functools.partial(func, *args, **kwargs))
+
+    def stats(self):
+        return {
+            "pending_tasks": len(self._tasks),
+            "spawned": self.spawned,
+            "failed": self.failed,
+            "threads": threading.active_count()
+        }
+
+    def _track(self, task):
+        # Tasks are only weakly referenced by the loop, so keep them until they finish
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.failed += 1
+            logging.error(f"Error in {task.get_coro().__qualname__}: {task.exception()}")
+
+
+bot_loop = BotLoop()
@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+from BotLoop import bot_loop
+from ChatWorkers import chat_workers
+from HelixClient import helix
+from Supervisor import supervisor
+from TTSObsWebsocket import broadcast_channel
+from TTSWorker import tts_worker
+from TwitchAPI import user_lookups
+from Viewers import viewers, viewer_lookups
+from config import load_settings
+
+settings = load_settings("settings.json")
+Stats_Log_Interval = float(settings.get("Stats_Log_Interval", 300))
+
+
+def collect_stats():
+    """Every component's counters in one dict. Walks the viewer registry, so run it off the bot loop."""
+    return {
+        "components": supervisor.stats(),
+        "helix": helix.stats(),
+        "tts": tts_worker.stats(),
+        "chat_workers": chat_workers.stats(),
+        "bot_loop": bot_loop.stats(),
+        "broadcasts": broadcast_channel.stats(),
+        "viewers": viewers.memory_report(),
+        "user_lookups": user_lookups.stats(),
+        "viewer_lookups": viewer_lookups.stats()
+    }
+
+
+async def log_stats(interval=Stats_Log_Interval):
+    """Logs collect_stats() at INFO every `interval` seconds until cancelled. 0 turns it off."""
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            for name, stats in (await bot_loop.run_blocking(collect_stats)).items():
+                logging.info(f"Stats {name}: {stats}")
+        except Exception as e:
+            logging.error(f"Could not collect stats: {e}")
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import deque
+
+from BotLoop import running_on
+from config import load_settings
+
+settings = load_settings("settings.json")
+Chat_Workers = int(settings.get("Chat_Workers", 8))
+Chat_Queue_Size = int(settings.get("Chat_Queue_Size", 100))
+
+
+class ChatWorkers:
+    """
+    A fixed number of worker tasks on the bot loop, each with its own bounded queue. Messages are
+    sharded by a hash of the username, so one user's messages are handled in the order they
+    arrived while different users are handled in parallel. submit() never waits and drops the
+    message when its shard is full; put() waits for room instead, for producers that can slow down.
+    """
+
+    def __init__(self, workers=Chat_Workers, queue_size=Chat_Queue_Size):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._loop = None
+        self._queues = []
+        self._tasks = []
+        self._waits = deque(maxlen=1000)  # recent (queue wait, handling time) pairs in seconds
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.workers)]
+        self._tasks = [self._loop.create_task(self._work(queue), name=f"ChatWorker-{i}")
+                       for i, queue in enumerate(self._queues)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, key, handler, *args):
+        """Queues handler(*args) (a coroutine function) on key's shard. Returns False if it was dropped."""
+        if not self._tasks:
+            logging.warning(f"Chat workers not running, dropped message from {key}")
+            self.dropped += 1
+            return False
+        if not running_on(self._loop):
+            self._loop.call_soon_threadsafe(self.submit, key, handler, *args)
+            return True
+
+        try:
+            self._shard(key).put_nowait((time.perf_counter(), handler, args))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.warning(f"Chat workers saturated, dropped message from {key}")
+            return False
+        self.submitted += 1
+        return True
+
+    async def put(self, key, handler, *args):
+        """Like submit(), but waits for room on the shard instead of dropping."""
+        await self._shard(key).put((time.perf_counter(), handler, args))
+        self.submitted += 1
+
+    def stats(self):
+        waits = sorted(wait for wait, _ in self._waits)
+        handling = sorted(handled for _, handled in self._waits)
+        return {
+            "workers": self.workers,
+            "queued": sum(queue.qsize() for queue in self._queues),
+            "busiest_queue": max((queue.qsize() for queue in self._queues), default=0),
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queue_wait_p50_ms": round(percentile(waits, 0.5) * 1000, 2),
+            "queue_wait_p95_ms": round(percentile(waits, 0.95) * 1000, 2),
+            "queue_wait_max_ms": round(waits[-1] * 1000 if waits else 0, 2),
+            "handling_p95_ms": round(percentile(handling, 0.95) * 1000, 2)
+        }
+
+    def _shard(self, key):
+        return self._queues[zlib.crc32(key.lower().encode("utf-8")) % self.workers]
+
+    async def _work(self, queue):
+        while True:
+            enqueued, handler, args = await queue.get()
+            started = time.perf_counter()
+            try:
+                await handler(*args)
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Error in {handler.__qualname__}: {e}")
+            self.processed += 1
+            self._waits.append((started - enqueued, time.perf_counter() - started))
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0
+
+
+chat_workers = ChatWorkers()
+
+
+if __name__ == '__main__':
+    # 50 users sending 100 messages each through the pool; checks per-user order and reports latency
+    async def benchmark():
+        workers = ChatWorkers(workers=8, queue_size=1000)
+        workers.start()
+        seen = {}
+
+        async def handle(username, number):
+            await asyncio.sleep(0)
+            seen.setdefault(username, []).append(number)
+
+        started = time.perf_counter()
+        for number in range(100):
+            for user in range(50):
+                await workers.put(f"user{user}", handle, f"user{user}", number)
+        while workers.processed < workers.submitted:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        await workers.stop()
+
+        in_order = all(numbers == sorted(numbers) for numbers in seen.values())
+        print(f"{workers.processed} messages in {elapsed:.2f}s, per-user order kept: {in_order}")
+        print(workers.stats())
+
+    asyncio.run(benchmark())
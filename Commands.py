@@ -5,12 +5,12 @@ import random
 import requests
 from datetime import datetime, timedelta
 import asyncio
-import json
 import re
-import aiohttp
 
 from BotTTS import text_to_shout, text_to_speech
 from Viewers import viewers
+from HelixClient import helix, HelixError, PRIORITY_COMMAND
+from BotLoop import bot_loop
 from config import settings_data, get_social_links, OBS_Browser_Source, Sanity_Bar
 
 
@@ -109,19 +109,15 @@ class ShoutCommand(BaseCommand):
 
 class RaffleCommand(BaseCommand):
     def __init__(self):
-        super().__init__(name="!raffle", cooldown=5, description="picks a random viewer in the chat")
+        super().__init__(name="!raffle", cooldown=5, description="picks a random viewer in the chat (add followers/subs, and tier/active to weight the draw)")
 
     async def execute(self, connection, username, message, channel, token, client_id, broadcaster_id):
         if self.can_execute(username):
-            raffle_message = message.split("!raffle", 1)
-            if len(raffle_message) > 1 and "followers" in raffle_message[1].strip().lower():
-                eligible_viewers = [viewer.username for viewer in viewers if viewer.following and viewer.username != username]
-            elif len(raffle_message) > 1 and "subs" in raffle_message[1].strip().lower():
-                eligible_viewers = [viewer.username for viewer in viewers if viewer.subscribed and viewer.username != username]
-            else:
-                eligible_viewers = [viewer.username for viewer in viewers if viewer.username != username]
+            options = message.split("!raffle", 1)[1].strip().lower().split() if "!raffle" in message else []
+            category = "followers" if "followers" in options else "subs" if "subs" in options else None
+            weighting = "tier" if "tier" in options else "activity" if "active" in options else None
 
-            chosen_viewer = random.choice(eligible_viewers) if eligible_viewers else " no eligible viewers"
+            chosen_viewer = viewers.draw(category, exclude=username, weighting=weighting) or " no eligible viewers"
             response = f"Hello @{username}, the winner of your raffle is: @{chosen_viewer}"
             connection.privmsg(channel, response)
             logging.info(f"Executed {self.name} command for {username}")
@@ -135,7 +131,7 @@ class LurkCommand(BaseCommand):
     async def execute(self, connection, username, message, channel, token, client_id, broadcaster_id):
         if self.can_execute(username):
             tts_message = f"{username} is watching you!"
-            await text_to_speech(tts_message)
+            await text_to_speech(tts_message, speaker=username)
             response = f"Enjoy lurking @{username}"
             connection.privmsg(channel, response)
             logging.info(f"Executed {self.name} command for {username}")
@@ -148,21 +144,15 @@ class SubsCommand(BaseCommand):
 
     async def execute(self, connection, username, message, channel, token, client_id, broadcaster_id):
         if self.can_execute(username):
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Client-Id": client_id
-            }
-            url = f"https://api.twitch.tv/helix/subscriptions?broadcaster_id={broadcaster_id}"
-
             try:
-                response = requests.get(url, headers=headers)
+                response = await helix.get("/subscriptions", params={"broadcaster_id": broadcaster_id}, priority=PRIORITY_COMMAND)
                 response.raise_for_status()
                 data = response.json()
 
                 subscribers = [sub['user_name'] for sub in data['data']]
                 subscriber_list = ', '.join(subscribers) if subscribers else "No subscribers found."
                 response_msg = f"@{username}, here are the subscribers: {subscriber_list}"
-            except requests.exceptions.RequestException as e:
+            except HelixError as e:
                 logging.error(f"Error fetching subscribers: {e}")
                 response_msg = "Failed to retrieve subscribers. Please try again later."
 
@@ -236,14 +226,8 @@ class UptimeCommand(BaseCommand):
 
     async def execute(self, connection, username, message, channel, token, client_id, broadcaster_id):
         if self.can_execute(username):
-            headers = {
-                "Authorization": f"Bearer {token}",
-                "Client-Id": client_id
-            }
-            url = f"https://api.twitch.tv/helix/streams?user_id={broadcaster_id}"
-
             try:
-                response = requests.get(url, headers=headers)
+                response = await helix.get("/streams", params={"user_id": broadcaster_id}, priority=PRIORITY_COMMAND)
                 response.raise_for_status()
                 data = response.json()
 
@@ -262,7 +246,7 @@ class UptimeCommand(BaseCommand):
                 else:
                     response_msg = f"@{username}, the stream is currently offline."
 
-            except requests.exceptions.RequestException as e:
+            except HelixError as e:
                 logging.error(f"Error fetching uptime: {e}")
                 response_msg = "Failed to retrieve uptime. Please try again later."
 
@@ -298,7 +282,7 @@ class DadJokeCommand(BaseCommand):
                     url_with_amount = f"{joke_url}&amount={joke_amount}"
 
                     # Fetch jokes from the API
-                    response = requests.get(url_with_amount)
+                    response = await bot_loop.run_blocking(requests.get, url_with_amount, timeout=10)
                     response.raise_for_status()
                     joke_data = response.json()
 
@@ -321,7 +305,7 @@ class DadJokeCommand(BaseCommand):
 
                 else:
                     # If no joke amount is specified, fetch just one joke
-                    response = requests.get(joke_url)
+                    response = await bot_loop.run_blocking(requests.get, joke_url, timeout=10)
                     response.raise_for_status()
                     joke_data = response.json()
 
@@ -374,7 +358,7 @@ class SocialsCommand(BaseCommand):
             self.on_cooldown(connection, username, channel)
 
 
-from TTSObsWebsocket import broadcast_message, connected_clients
+from TTSObsWebsocket import broadcast_message, broadcast_channel
 
 class VoteCommand(BaseCommand):
     active_vote = None
@@ -399,7 +383,7 @@ class VoteCommand(BaseCommand):
         parts = message.split(" ", 1)
 
         # Only moderators can start a vote
-        if username not in [viewer.username for viewer in viewers if viewer.mod]:
+        if not viewers.is_mod(username):
             connection.privmsg(channel, f"@{username}, only moderators can start a vote!")
             return
 
@@ -438,13 +422,11 @@ class VoteCommand(BaseCommand):
                     }
                     await broadcast_message(username, "", 0)
                     await asyncio.sleep(0.1)
-                    await asyncio.gather(*[
-                        client.send(json.dumps(vote_payload)) for client in connected_clients
-                    ])
+                    broadcast_channel.post(vote_payload)
                     logging.info(f"Vote sent to browser source: {vote_payload}")
                 else:
                     logging.info("OBS web browser source is offline, creating Twitch poll instead.")
-                    success, result = await create_twitch_poll(token, client_id, broadcaster_id, question, options)
+                    success, result = await create_twitch_poll(broadcaster_id, question, options)
                     if success:
                         connection.privmsg(channel, f"📊 A Twitch poll has been started! Vote using the poll above!")
                     else:
@@ -489,9 +471,7 @@ class VoteCommand(BaseCommand):
                     },
                     "voteCounts": vote_counts
                 }
-                await asyncio.gather(*[
-                    client.send(json.dumps(vote_payload)) for client in connected_clients
-                ])
+                broadcast_channel.post(vote_payload)
                 logging.info(f"Vote response sent to browser source: {vote_payload}")
 
     @classmethod
@@ -519,16 +499,10 @@ class VoteCommand(BaseCommand):
             cls.vote_responses = {}
             cls.vote_end_time = None
 
-async def create_twitch_poll(token, client_id, broadcaster_id, question, options, duration=60):
+async def create_twitch_poll(broadcaster_id, question, options, duration=60):
     """
     Creates a Twitch poll using the Helix API.
     """
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Client-ID": client_id,
-        "Content-Type": "application/json"
-    }
-
     payload = {
         "broadcaster_id": broadcaster_id,
         "title": question.strip()[:60],
@@ -537,16 +511,13 @@ async def create_twitch_poll(token, client_id, broadcaster_id, question, options
     }
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post("https://api.twitch.tv/helix/polls", headers=headers, json=payload) as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    logging.info(f"Twitch poll successfully created: {result}")
-                    return True, result
-                else:
-                    error_text = await resp.text()
-                    logging.warning(f"Failed to create Twitch poll: {resp.status} - {error_text}")
-                    return False, error_text
+        response = await helix.post("/polls", json=payload, priority=PRIORITY_COMMAND)
+        if response.status == 200:
+            logging.info(f"Twitch poll successfully created: {response.data}")
+            return True, response.data
+        else:
+            logging.warning(f"Failed to create Twitch poll: {response.status} - {response.data}")
+            return False, str(response.data)
     except Exception as e:
         logging.error(f"Exception during Twitch poll creation: {e}")
         return False, str(e)
@@ -586,9 +557,7 @@ class SanityCommand(BaseCommand):
                         "type": "sanity",
                         "value": avg_sanity
                     }
-                    await asyncio.gather(*[
-                        client.send(json.dumps(sanity_payload)) for client in connected_clients
-                    ])
+                    broadcast_channel.post(sanity_payload)
                     logging.info(f"Updated sanity sent to OBS: {sanity_payload}")
 
                 # Confirm vote in chat
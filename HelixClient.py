@@ -0,0 +1,327 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+import aiohttp
+
+from BotLoop import running_on
+
+HELIX_URL = "https://api.twitch.tv/helix"
+
+# Request priorities, lowest value first
+PRIORITY_COMMAND = 0     # something the broadcaster or a viewer is waiting on
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2  # viewer enrichment and role preloading
+
+BUCKET_WINDOW = 60  # seconds Helix takes to refill an empty rate-limit bucket
+
+
+class HelixError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class HelixResponse:
+    def __init__(self, status, data, headers):
+        self.status = status
+        self.data = data  # decoded JSON body, or the raw text if it wasn't JSON
+        self.headers = headers
+
+    def raise_for_status(self):
+        if not 200 <= self.status < 300:
+            message = self.data.get("message", self.data) if isinstance(self.data, dict) else self.data
+            raise HelixError(f"Helix request failed: {self.status} - {message}", self.status)
+
+    def json(self):
+        return self.data if isinstance(self.data, dict) else {}
+
+
+class RateLimitScheduler:
+    """
+    Tracks the Helix rate-limit bucket from the Ratelimit-* response headers and hands out
+    permission to send. When the bucket runs low, requests wait in a priority queue until it
+    refills instead of being sent and rejected; background requests also leave `reserve` points
+    unused so commands can still go through during a raid. Only used from the client's loop.
+    """
+
+    def __init__(self, reserve=10):
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None  # unknown until the first response
+        self.reset_at = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.max_depth = 0
+        self._waiting = []  # heap of (priority, seq, future)
+        self._counter = itertools.count()
+        self._dispatcher = None
+
+    async def acquire(self, priority):
+        # Only jump the queue when nothing of the same or higher priority is already waiting
+        if (not self._waiting or priority < self._waiting[0][0]) and self._has_budget(priority):
+            self._consume()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._counter), future))
+        self.max_depth = max(self.max_depth, len(self._waiting))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+        started = time.monotonic()
+        await future
+        waited = time.monotonic() - started
+        self.waited += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def update(self, headers):
+        try:
+            if "Ratelimit-Limit" in headers:
+                self.limit = int(headers["Ratelimit-Limit"])
+            if "Ratelimit-Remaining" in headers:
+                self.remaining = int(headers["Ratelimit-Remaining"])
+            if "Ratelimit-Reset" in headers:
+                self.reset_at = float(headers["Ratelimit-Reset"])
+        except ValueError as e:
+            logging.warning(f"Could not parse Helix rate-limit headers: {e}")
+
+    def exhausted(self, headers):
+        """Called on a 429: empties the bucket until its reset time (or a second from now if not given)."""
+        self.update(headers)
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.time() + 1)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "remaining": self.remaining,
+            "queue_depth": len(self._waiting),
+            "max_queue_depth": self.max_depth,
+            "waited": self.waited,
+            "avg_wait_ms": self.total_wait / self.waited * 1000 if self.waited else 0,
+            "max_wait_ms": self.max_wait * 1000
+        }
+
+    def _has_budget(self, priority):
+        if self.remaining is None:
+            return True
+        now = time.time()
+        if now >= self.reset_at:
+            if self.limit is None:
+                return True
+            # Refill once, then assume another full window until response headers say otherwise,
+            # so a burst sent after the reset time still counts down
+            self.remaining = self.limit
+            self.reset_at = now + BUCKET_WINDOW
+        needed = 1 if priority <= PRIORITY_COMMAND else self.reserve + 1
+        return self.remaining >= needed
+
+    def _consume(self):
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    async def _dispatch(self):
+        while self._waiting:
+            priority, _, future = self._waiting[0]
+            if future.cancelled():
+                heapq.heappop(self._waiting)
+            elif self._has_budget(priority):
+                heapq.heappop(self._waiting)
+                self._consume()
+                future.set_result(None)
+            else:
+                await asyncio.sleep(max(0.05, self.reset_at - time.time()))
+
+
+class HelixClient:
+    """
+    Shared async client for the Twitch Helix API. All modules go through one aiohttp session, so
+    connections are kept alive and reused instead of doing a TLS handshake per call. Requests time
+    out, are retried with jittered exponential backoff on network errors and 5xx, and a 401
+    refreshes the OAuth token once before retrying. Every attempt first goes through the rate-limit
+    scheduler, so a 429 defers the request until the bucket resets rather than failing it.
+
+    The session lives on one event loop: the bot's main loop, which Bot.main() passes to start(),
+    or a background thread's own loop for standalone use. request() can be awaited from any loop
+    and request_sync() called from any other thread; both are forwarded to that loop.
+    """
+
+    def __init__(self, timeout=10, retries=3, backoff=0.5, max_backoff=8, connections=20):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connections = connections
+        self.token = None
+        self.client_id = None
+        self.client_secret = None
+        self.requests = 0
+        self.retried = 0
+        self.token_refreshes = 0
+        self.deferred = 0
+        self._token_listeners = []
+        self._loop = None
+        self._session = None
+        self._start_lock = threading.Lock()
+        self._refresh_lock = None
+        self.scheduler = RateLimitScheduler()
+
+    def configure(self, token, client_id, client_secret=None):
+        self.token = token.replace("oauth:", "").strip() if token else None
+        self.client_id = client_id
+        self.client_secret = client_secret
+
+    def add_token_listener(self, callback):
+        """Registers a function called with the new token ("oauth:..." form) whenever it is refreshed."""
+        self._token_listeners.append(callback)
+
+    def start(self, loop=None):
+        """Binds the client to `loop`, or to a new event loop on a background thread if none is given."""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            if loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="HelixClient", daemon=True).start()
+            self._loop = loop
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def get(self, path, params=None, priority=PRIORITY_DEFAULT):
+        return await self.request("GET", path, params=params, priority=priority)
+
+    async def post(self, path, params=None, json=None, priority=PRIORITY_DEFAULT):
+        return await self.request("POST", path, params=params, json=json, priority=priority)
+
+    async def request(self, method, path, params=None, json=None, priority=PRIORITY_DEFAULT):
+        self.start()
+        coroutine = self._request(method, path, params, json, priority)
+        if running_on(self._loop):
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._loop))
+
+    def request_sync(self, method, path, params=None, json=None, priority=PRIORITY_DEFAULT):
+        """Blocking version of request() for code running on plain threads."""
+        if running_on(self._loop):
+            raise RuntimeError("request_sync() would block the Helix client's own loop; await request() instead")
+        return self.submit(self._request(method, path, params, json, priority)).result()
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the client's loop from any thread and returns a concurrent Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "token_refreshes": self.token_refreshes,
+            "deferred": self.deferred,
+            "rate_limit": self.scheduler.stats()
+        }
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _headers(self):
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Client-Id": self.client_id
+        }
+
+    async def _request(self, method, path, params, json, priority):
+        if not self.token or not self.client_id:
+            raise HelixError("Helix client used before Twitch credentials were configured")
+
+        refreshed = False
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(priority)
+            self.requests += 1
+            try:
+                async with self._get_session().request(method, f"{HELIX_URL}{path}", params=params,
+                                                       json=json, headers=self._headers()) as resp:
+                    try:
+                        data = await resp.json(content_type=None)
+                    except ValueError:
+                        data = await resp.text()
+                    response = HelixResponse(resp.status, data, resp.headers)
+                self.scheduler.update(response.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries:
+                    raise HelixError(f"Helix request {method} {path} failed: {e!r}") from e
+                logging.warning(f"Helix request {method} {path} failed ({e!r}), retrying")
+                await self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            if response.status == 401 and not refreshed:
+                refreshed = True
+                if await self._refresh_token():
+                    continue
+                return response
+
+            if response.status == 429:
+                # Out of points: wait in the scheduler for the bucket to reset and send again
+                self.deferred += 1
+                self.scheduler.exhausted(response.headers)
+                logging.warning(f"Helix rate limit hit on {method} {path}, deferring until reset")
+                continue
+
+            if response.status >= 500 and attempt < self.retries:
+                logging.warning(f"Helix request {method} {path} returned {response.status}, retrying")
+                await self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            return response
+
+    async def _sleep_before_retry(self, attempt):
+        self.retried += 1
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+
+    async def _refresh_token(self):
+        from Autherisation_URL import refresh_token_if_available
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        stale_token = self.token
+        async with self._refresh_lock:
+            if self.token != stale_token:
+                return True  # another request already refreshed it
+
+            logging.warning("Helix returned 401, refreshing Twitch token...")
+            new_token = await asyncio.get_running_loop().run_in_executor(
+                None, refresh_token_if_available, self.client_id, self.client_secret)
+            if not new_token:
+                logging.error("Could not refresh Twitch token.")
+                return False
+
+            self.token = new_token.replace("oauth:", "").strip()
+            self.token_refreshes += 1
+            for callback in self._token_listeners:
+                try:
+                    callback(new_token)
+                except Exception as e:
+                    logging.error(f"Error applying refreshed token: {e}")
+            return True
+
+
+helix = HelixClient()
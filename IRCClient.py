@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import random
+import ssl
+import time
+
+from BotLoop import running_on
+
+# Numeric replies and commands mapped to the event names handlers register for
+EVENT_TYPES = {
+    "001": "welcome",
+    "353": "namreply",
+    "366": "endofnames"
+}
+
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def unescape_tag(value):
+    """Undoes IRCv3 tag value escaping (\\: \\s \\\\ \\r \\n)."""
+    result = []
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char == "\\" and i + 1 < len(value):
+            i += 1
+            result.append(TAG_ESCAPES.get(value[i], value[i]))
+        elif char != "\\":
+            result.append(char)
+        i += 1
+    return "".join(result)
+
+
+class Source(str):
+    """A message prefix ("nick!user@host") that also exposes the nick."""
+
+    @property
+    def nick(self):
+        return self.split("!", 1)[0]
+
+
+class IRCEvent:
+    __slots__ = ("type", "command", "source", "target", "arguments", "tags")
+
+    def __init__(self, type, command, source, target, arguments, tags):
+        self.type = type
+        self.command = command
+        self.source = source
+        self.target = target
+        self.arguments = arguments
+        self.tags = tags
+
+    def __repr__(self):
+        return f"IRCEvent({self.type}, {self.source}, {self.target}, {self.arguments})"
+
+
+def parse_line(line):
+    """Parses one IRCv3 line (without the CRLF) into an IRCEvent."""
+    tags = {}
+    if line.startswith("@"):
+        raw_tags, _, line = line[1:].partition(" ")
+        for item in raw_tags.split(";"):
+            key, _, value = item.partition("=")
+            tags[key] = unescape_tag(value) if "\\" in value else value
+
+    source = None
+    if line.startswith(":"):
+        prefix, _, line = line[1:].partition(" ")
+        source = Source(prefix)
+
+    if " :" in line:
+        head, _, trailing = line.partition(" :")
+        params = head.split()
+        params.append(trailing)
+    else:
+        params = line.split()
+
+    command = params[0].upper() if params else ""
+    target = params[1] if len(params) > 1 else None
+    arguments = params[2:]
+
+    event_type = EVENT_TYPES.get(command)
+    if event_type is None:
+        if command in ("PRIVMSG", "NOTICE"):
+            public = target is not None and target.startswith("#")
+            event_type = ("pub" if public else "priv") + ("msg" if command == "PRIVMSG" else "notice")
+        else:
+            event_type = command.lower()
+
+    return IRCEvent(event_type, command, source, target, arguments, tags)
+
+
+class LineParser:
+    """Incremental parser: feed() raw socket data and get back the events for every complete line."""
+
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data):
+        lines = (self._buffer + data).split(b"\r\n")
+        self._buffer = lines.pop()  # incomplete last line, if any
+        return [parse_line(line.decode("utf-8", "replace")) for line in lines if line]
+
+
+class TwitchIRCClient:
+    """
+    asyncio IRCv3 client for Twitch chat. run() connects, logs in and dispatches every event to the
+    handlers registered with on() on the event loop it runs on, answers PING itself, and reconnects
+    with jittered exponential backoff when the connection drops or Twitch sends RECONNECT. After
+    ping_interval seconds of silence it sends its own PING, and drops the connection if that gets
+    no answer within another ping_interval. Handlers
+    receive (client, event) like irc.client handlers did; one that returns a coroutine has it run
+    as a task.
+    """
+
+    def __init__(self, server, port, nickname, token, use_ssl=True, reconnect_delay=1, max_reconnect_delay=60,
+                 ping_interval=60):
+        self.server = server
+        self.port = port
+        self.nickname = nickname
+        self.token = token
+        self.use_ssl = use_ssl
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.ping_interval = ping_interval
+        self.lines = 0
+        self.reconnects = 0
+        self._handlers = {}
+        self._writer = None
+        self._loop = None
+        self._closing = False
+        self._reconnect_now = False
+        self._failures = 0  # connection attempts since the last successful login
+
+    def on(self, event_type, handler):
+        """Registers a handler for an event type ("pubmsg", "join", ...) or "all_events"."""
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        while not self._closing:
+            try:
+                await self._session()
+            except (OSError, asyncio.IncompleteReadError, ssl.SSLError) as e:
+                logging.warning(f"IRC connection to {self.server} lost: {e}")
+            if self._closing:
+                break
+
+            self.reconnects += 1
+            if self._reconnect_now:
+                self._reconnect_now = False
+                continue
+            delay = min(self.max_reconnect_delay, self.reconnect_delay * 2 ** self._failures)
+            self._failures += 1
+            delay *= random.uniform(0.5, 1.5)
+            logging.info(f"Reconnecting to {self.server} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        logging.info("IRC client stopped.")
+
+    def reconnect(self):
+        """Drops the current connection; run() connects again straight away."""
+        self._reconnect_now = True
+        self._close_writer()
+
+    def close(self):
+        self._closing = True
+        self._close_writer()
+
+    def send_raw(self, line):
+        if self._writer is None or self._writer.is_closing():
+            logging.warning(f"IRC not connected, dropped: {line.split(' ', 1)[0]}")
+            return
+        data = (line.replace("\r", " ").replace("\n", " ") + "\r\n").encode("utf-8")
+        if running_on(self._loop):
+            self._writer.write(data)
+        else:
+            self._loop.call_soon_threadsafe(self._writer.write, data)
+
+    def privmsg(self, target, text):
+        self.send_raw(f"PRIVMSG {target} :{text}")
+
+    def join(self, channel):
+        self.send_raw(f"JOIN {channel}")
+
+    def cap(self, subcommand, *args):
+        self.send_raw(" ".join(("CAP", subcommand) + args))
+
+    async def _session(self):
+        ssl_context = ssl.create_default_context() if self.use_ssl else None
+        logging.info("Connecting to chat...")
+        reader, self._writer = await asyncio.open_connection(self.server, self.port, ssl=ssl_context)
+
+        token = self.token if self.token.startswith("oauth:") else f"oauth:{self.token}"
+        self.send_raw(f"PASS {token}")
+        self.send_raw(f"NICK {self.nickname}")
+
+        parser = LineParser()
+        pinged = False
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(65536), self.ping_interval)
+                except asyncio.TimeoutError:
+                    if pinged:
+                        logging.warning(f"No reply from {self.server} in {self.ping_interval * 2}s")
+                        return
+                    self.send_raw(f"PING :{self.server}")
+                    pinged = True
+                    continue
+                pinged = False
+                if not data:
+                    logging.warning(f"IRC server {self.server} closed the connection")
+                    return
+                for event in parser.feed(data):
+                    self.lines += 1
+                    if not self._handle(event):
+                        return
+        finally:
+            self._close_writer()
+
+    def _handle(self, event):
+        """Dispatches one event. Returns False when the connection should be dropped."""
+        if event.command == "PING":
+            self.send_raw(f"PONG :{event.target or ''}")
+        elif event.command == "RECONNECT":
+            logging.info("Twitch asked the bot to reconnect")
+            self._reconnect_now = True
+            return False
+        elif event.type == "welcome":
+            self._failures = 0
+            logging.info(f"Connected to {self.server} as {self.nickname}")
+
+        for handlers in (self._handlers.get(event.type), self._handlers.get("all_events")):
+            for handler in handlers or ():
+                try:
+                    result = handler(self, event)
+                    if asyncio.iscoroutine(result):
+                        self._loop.create_task(result)
+                except Exception as e:
+                    logging.error(f"Error in IRC handler for {event.type}: {e}")
+        return not self._closing
+
+    def _close_writer(self):
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            if running_on(self._loop) or self._loop is None:
+                writer.close()
+            else:
+                self._loop.call_soon_threadsafe(writer.close)
+
+
+if __name__ == '__main__':
+    # Parse throughput against a fake local IRC server sending a burst of tagged chat lines
+    count = 100000
+    line = ("@badge-info=subscriber/12;badges=subscriber/3012,premium/1;color=#FF4500;display-name=Viewer;"
+            "emotes=;id=6c3b6a1c-5f1b-4c2a-9d4e-000000000000;mod=0;room-id=12345;subscriber=1;"
+            "tmi-sent-ts=1700000000000;turbo=0;user-id=67890;user-type= "
+            ":viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #channel :hello chat, this is a test message\r\n")
+
+    started = time.perf_counter()
+    for _ in range(count):
+        parse_line(line[:-2])
+    print(f"parse_line: {count / (time.perf_counter() - started):,.0f} lines/s")
+
+    async def fake_server(reader, writer):
+        while b"NICK" not in await reader.readline():
+            pass
+        writer.write(b":tmi.twitch.tv 001 bot :Welcome, GLHF!\r\n")
+        writer.write(line.encode("utf-8") * count)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass  # the client hangs up once it has everything
+        writer.close()
+
+    async def benchmark():
+        server = await asyncio.start_server(fake_server, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = TwitchIRCClient("127.0.0.1", port, "bot", "token", use_ssl=False)
+        received = []
+
+        def on_pubmsg(connection, event):
+            received.append(event)
+            if len(received) == count:
+                connection.close()
+
+        client.on("pubmsg", on_pubmsg)
+        started = time.perf_counter()
+        await client.run()
+        elapsed = time.perf_counter() - started
+        server.close()
+        print(f"Client over TCP: {len(received)} messages in {elapsed:.2f}s, {len(received) / elapsed:,.0f} lines/s")
+
+    asyncio.run(benchmark())
@@ -0,0 +1,153 @@
+import random
+import sys
+
+
+class IndexedSet:
+    """
+    A set that can also be sampled uniformly in O(1). Items are kept in a list with a dict of their
+    positions, and removal swaps the last item into the gap. Not thread-safe on its own.
+    """
+
+    def __init__(self, items=()):
+        self._items = []
+        self._positions = {}
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        if item not in self._positions:
+            self._positions[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        last = self._items.pop()
+        if position < len(self._items):
+            self._items[position] = last
+            self._positions[last] = position
+
+    def sample(self, exclude=None):
+        """Returns a uniformly random item other than `exclude`, or None if there isn't one."""
+        count = len(self._items)
+        excluded = self._positions.get(exclude) if exclude is not None else None
+        if excluded is None:
+            return self._items[random.randrange(count)] if count else None
+        if count < 2:
+            return None
+        # Draw from every position but the excluded one
+        position = random.randrange(count - 1)
+        return self._items[position + 1 if position >= excluded else position]
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self._items) + sys.getsizeof(self._positions)
+
+
+class WeightedSet:
+    """
+    A set of items with positive integer weights, sampled in proportion to their weight. The
+    weights sit in a Fenwick tree, so adding, removing or reweighting an item and drawing from the
+    set are all O(log n), and weights can change on every chat message without rebuilding
+    anything. Removal swaps the last item into the gap like IndexedSet. Not thread-safe on its own.
+    """
+
+    def __init__(self):
+        self._items = []
+        self._weights = []
+        self._tree = [0]  # 1-based; node i holds the sum of the weights in (i - lowbit(i), i]
+        self._positions = {}
+
+    def add(self, item, weight):
+        """Adds an item, or sets its weight if it is already in the set."""
+        if item in self._positions:
+            self.update(item, weight)
+            return
+        self._positions[item] = len(self._items)
+        self._items.append(item)
+        self._weights.append(weight)
+        node = len(self._items)
+        self._tree.append(weight + self._prefix(node - 1) - self._prefix(node - (node & -node)))
+
+    def update(self, item, weight):
+        position = self._positions.get(item)
+        if position is not None and weight != self._weights[position]:
+            self._add(position, weight - self._weights[position])
+            self._weights[position] = weight
+
+    def discard(self, item):
+        position = self._positions.pop(item, None)
+        if position is None:
+            return
+        last = len(self._items) - 1
+        if position < last:
+            moved = self._items[last]
+            self._add(position, self._weights[last] - self._weights[position])
+            self._weights[position] = self._weights[last]
+            self._items[position] = moved
+            self._positions[moved] = position
+        # The last node only ever covers ranges that end at itself, so it can simply go
+        self._items.pop()
+        self._weights.pop()
+        self._tree.pop()
+
+    def sample(self, exclude=None):
+        """Returns an item drawn by weight, never `exclude`, or None if nothing else has any weight."""
+        excluded = self._positions.get(exclude) if exclude is not None else None
+        skipped = self._weights[excluded] if excluded is not None else 0
+        total = self._prefix(len(self._items)) - skipped
+        if total <= 0:
+            return None
+        target = random.randrange(total)
+        if excluded is not None and target >= self._prefix(excluded):
+            target += skipped  # step over the excluded item's share
+        return self._items[self._find(target)]
+
+    def weight(self, item):
+        position = self._positions.get(item)
+        return self._weights[position] if position is not None else 0
+
+    def _add(self, position, delta):
+        node = position + 1
+        while node < len(self._tree):
+            self._tree[node] += delta
+            node += node & -node
+
+    def _prefix(self, count):
+        """Sum of the first `count` weights."""
+        total = 0
+        while count > 0:
+            total += self._tree[count]
+            count -= count & -count
+        return total
+
+    def _find(self, target):
+        """Position of the item whose share of the running total contains `target`."""
+        position = 0
+        step = 1 << (len(self._items).bit_length() - 1) if self._items else 0
+        while step:
+            node = position + step
+            if node < len(self._tree) and self._tree[node] <= target:
+                position = node
+                target -= self._tree[node]
+            step >>= 1
+        return position
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __len__(self):
+        return len(self._items)
+
+    def __sizeof__(self):
+        return (object.__sizeof__(self) + sys.getsizeof(self._items) + sys.getsizeof(self._weights) +
+                sys.getsizeof(self._tree) + sys.getsizeof(self._positions))
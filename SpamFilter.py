@@ -0,0 +1,122 @@
+import logging
+import re
+import timeit
+
+from config import load_settings
+
+SPAM_LINK_KEYWORDS = [".com", "dot com", ".net", "dot net", ".xyz", "dot xyz", "http", "www", "discord.gg",
+                      "free viewers"]
+
+REPEATED_CHARACTER = re.compile(r"(.)\1{4,}")
+WORD = re.compile(r"\w+")  # punctuation doesn't split a repeat, as with the old \b\w+\b regex
+MAX_PHRASE_WORDS = 5    # longest phrase checked for repetition
+PHRASE_REPEATS = 3      # times a phrase must appear back to back to count as spam
+
+
+class SpamFilter:
+    """
+    Compiled spam checks for TTS messages. All keywords are merged into one alternation so a
+    message is scanned once, and repeated phrases are found with a linear word scan instead of a
+    backtracking regex. check() returns a description of the rule that fired, or None.
+    """
+
+    def __init__(self, keywords=SPAM_LINK_KEYWORDS, patterns=()):
+        # Longest keywords first so the reported match is the most specific one
+        keywords = sorted({k.lower() for k in keywords if k}, key=len, reverse=True)
+        self.keyword_pattern = re.compile("|".join(re.escape(k) for k in keywords)) if keywords else None
+        self.patterns = []
+        for pattern in patterns:
+            try:
+                self.patterns.append(re.compile(pattern, re.IGNORECASE))
+            except re.error as e:
+                logging.error(f"Ignoring invalid spam pattern {pattern!r}: {e}")
+
+    @classmethod
+    def from_settings(cls, settings):
+        keywords = SPAM_LINK_KEYWORDS + list(settings.get("TTS_Spam_Keywords", []))
+        return cls(keywords, settings.get("TTS_Spam_Patterns", []))
+
+    def check(self, message):
+        text = message.lower()
+
+        if self.keyword_pattern:
+            match = self.keyword_pattern.search(text)
+            if match:
+                return f"potential spam or link ({match.group(0)!r})"
+
+        match = REPEATED_CHARACTER.search(text)
+        if match:
+            return f"repeated character spam ({match.group(0)!r})"
+
+        phrase = find_repeated_phrase(WORD.findall(text))
+        if phrase:
+            return f"repeated phrase spam ({phrase!r})"
+
+        for pattern in self.patterns:
+            if pattern.search(text):
+                return f"custom spam pattern ({pattern.pattern!r})"
+
+        return None
+
+
+def find_repeated_phrase(words, max_words=MAX_PHRASE_WORDS, repeats=PHRASE_REPEATS):
+    """
+    Returns the first 1 to max_words word phrase repeated back to back `repeats` times, or None.
+    A phrase of n words repeats when words[i] == words[i + n] holds for n * (repeats - 1) positions
+    in a row, so each phrase length costs one linear pass.
+    """
+    for size in range(1, max_words + 1):
+        needed = size * (repeats - 1)
+        run = 0
+        for i, (word, later) in enumerate(zip(words, words[size:])):
+            if word == later:
+                run += 1
+                if run >= needed:
+                    start = i - run + 1
+                    return " ".join(words[start:start + size])
+            else:
+                run = 0
+    return None
+
+
+def legacy_check(message):
+    """The inline checks BotTTS.text_to_speech used before SpamFilter, kept for the benchmark."""
+    keywords = [".com", "dot com", ".net", "dot net", ".xyz", "dot xyz", "http", "www", "discord.gg",
+                "free viewers"]
+    if any(keyword in message.lower() for keyword in keywords):
+        return "potential spam or link"
+    if re.search(r"(.)\1{4,}", message.lower()):
+        return "repeated character spam"
+    if re.search(r"(\b\w+\b(?:\s+\b\w+\b){0,4})\s+\1\s+\1", message.lower()):
+        return "repeated phrase spam"
+    return None
+
+
+if __name__ == '__main__':
+    spam_filter = SpamFilter.from_settings(load_settings("settings.json"))
+    messages = {
+        "normal chat": "someone says that boss fight was actually insane, gg",
+        "distinct words": "someone says " + " ".join(f"word{i}" for i in range(80)),
+        "near repeats": "someone says " + "abc def ghi jkl mno " * 2 + " ".join(f"w{i}" for i in range(70)),
+        "alternating": "someone says " + "ab cd " * 40 + "ab",
+        "link at end": "someone says " + "hello there " * 10 + "check out my stream dot com",
+    }
+
+    # Both checks must agree on whether these are spam
+    cases = ["lol lol lol!", "gg gg gg.", "GG gg Gg", "no way no way no way?", "(pog pog pog)",
+             "lol lol", "gg wp gg", "that was a good game, gg"]
+    for message in cases:
+        legacy, compiled = legacy_check(message), spam_filter.check(message)
+        assert (legacy is None) == (compiled is None), (message, legacy, compiled)
+        print(f"{message!r:35} legacy: {legacy}  compiled: {compiled}")
+
+    # The old regex needed nothing but spaces between repeats; these are caught only now
+    for message in ["hype! hype! hype!", "nice shot, nice shot, nice shot"]:
+        assert legacy_check(message) is None and spam_filter.check(message), message
+        print(f"{message!r:35} legacy: None  compiled: {spam_filter.check(message)}")
+
+    for name, message in messages.items():
+        legacy = timeit.timeit(lambda: legacy_check(message), number=2000)
+        compiled = timeit.timeit(lambda: spam_filter.check(message), number=2000)
+        print(f"{name:15} legacy {legacy * 500:8.1f} us  compiled {compiled * 500:8.1f} us  "
+              f"-> {spam_filter.check(message)}")
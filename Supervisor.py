@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from config import load_settings
+
+settings = load_settings("settings.json")
+Supervisor_Heartbeat_Timeout = float(settings.get("Supervisor_Heartbeat_Timeout", 180))
+Supervisor_Restart_Delay = float(settings.get("Supervisor_Restart_Delay", 1))
+Supervisor_Max_Restart_Delay = float(settings.get("Supervisor_Max_Restart_Delay", 300))
+
+STABLE_AFTER = 60  # seconds a component must stay up before its backoff resets
+
+# The one shutdown signal for the whole bot; any thread can set it
+shutdown_event = threading.Event()
+
+
+class Component:
+    def __init__(self, name, run, heartbeat_timeout):
+        self.name = name
+        self.run = run
+        self.heartbeat_timeout = heartbeat_timeout
+        self.task = None
+        self.started_at = None
+        self.last_beat = None  # None until the current run has reported in
+        self.up_since = None
+        self.down_since = None
+        self.restart_at = 0  # None once it has stopped for good
+        self.failures = 0  # consecutive failures, for the backoff
+        self.restarts = 0
+        self.downtime = 0.0
+        self.last_error = None
+
+
+class Supervisor:
+    """
+    Runs each part of the bot (chat connections, the WebSocket server, the TTS worker) as its own
+    task on the bot loop and restarts only the part that fails, with capped, jittered exponential
+    backoff. A component counts as up once it calls heartbeat(name); after that, going
+    heartbeat_timeout seconds without one is treated as a hang and the task is cancelled and
+    restarted. A component that returns without an error has chosen to stop (missing credentials,
+    nothing to connect to) and is left stopped. Restarts and the time each component spent down
+    are kept for stats().
+    """
+
+    def __init__(self, heartbeat_timeout=Supervisor_Heartbeat_Timeout, restart_delay=Supervisor_Restart_Delay,
+                 max_restart_delay=Supervisor_Max_Restart_Delay):
+        self.heartbeat_timeout = heartbeat_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.components = {}
+        self.started_at = None
+        self._lock = threading.Lock()
+
+    def add(self, name, run, heartbeat_timeout=None):
+        """Registers a component. `run` is a coroutine function that runs until shutdown, or returns to stop for good."""
+        self.components[name] = Component(name, run, heartbeat_timeout or self.heartbeat_timeout)
+
+    def heartbeat(self, name):
+        """Marks a component as alive. Safe to call from any thread."""
+        component = self.components.get(name)
+        if component is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            component.last_beat = now
+            if component.up_since is None:
+                component.up_since = now
+                if component.down_since is not None:
+                    component.downtime += now - component.down_since
+                    component.down_since = None
+                    if component.restarts:
+                        logging.info(f"{name} is back up after {component.restarts} restart(s)")
+
+    def shutdown(self):
+        shutdown_event.set()
+
+    async def run(self):
+        """Starts every component and watches them until shutdown_event is set."""
+        self.started_at = time.monotonic()
+        for component in self.components.values():
+            component.down_since = self.started_at  # down until it first reports in
+            self._start(component)
+
+        try:
+            while not shutdown_event.is_set():
+                await asyncio.sleep(1)
+                self._check()
+        finally:
+            tasks = [component.task for component in self.components.values() if component.task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for name, stats in self.stats().items():
+                logging.info(f"{name}: {stats['restarts']} restart(s), {stats['downtime_seconds']}s down, "
+                             f"{stats['availability']:.2%} available")
+
+    def stats(self):
+        now = time.monotonic()
+        elapsed = max(now - self.started_at, 1e-9) if self.started_at else 0
+        report = {}
+        with self._lock:
+            for name, component in self.components.items():
+                downtime = component.downtime
+                if component.down_since is not None:
+                    downtime += now - component.down_since
+                report[name] = {
+                    "up": component.up_since is not None,
+                    "stopped": component.restart_at is None,
+                    "restarts": component.restarts,
+                    "downtime_seconds": round(downtime, 1),
+                    "availability": 1 - downtime / elapsed if elapsed else 0,
+                    "last_error": component.last_error
+                }
+        return report
+
+    def _start(self, component):
+        component.task = asyncio.get_running_loop().create_task(component.run(), name=component.name)
+        component.started_at = time.monotonic()
+        component.last_beat = None
+
+    def _check(self):
+        now = time.monotonic()
+        for component in self.components.values():
+            task = component.task
+            if task is None:
+                if component.restart_at is not None and now >= component.restart_at:
+                    component.restarts += 1
+                    logging.info(f"Restarting {component.name} (restart {component.restarts})")
+                    self._start(component)
+            elif task.done():
+                if task.cancelled():
+                    self._failed(component, "cancelled")
+                elif task.exception() is not None:
+                    self._failed(component, repr(task.exception()))
+                else:
+                    self._stopped(component)
+            elif component.last_beat is not None and now - component.last_beat > component.heartbeat_timeout:
+                task.cancel()
+                # It has been down since it went quiet, not since we noticed
+                self._failed(component, f"no heartbeat for {now - component.last_beat:.0f}s", component.last_beat)
+
+    def _stopped(self, component):
+        with self._lock:
+            if component.down_since is None:
+                component.down_since = time.monotonic()
+            component.up_since = None
+        component.task = None
+        component.restart_at = None
+        logging.warning(f"{component.name} stopped and will not be restarted")
+
+    def _failed(self, component, reason, since=None):
+        now = time.monotonic()
+        with self._lock:
+            if component.up_since is not None and now - component.up_since >= STABLE_AFTER:
+                component.failures = 0
+            if component.down_since is None:
+                component.down_since = since or now
+            component.up_since = None
+        delay = min(self.max_restart_delay, self.restart_delay * 2 ** component.failures)
+        delay *= random.uniform(0.5, 1.5)
+        component.failures += 1
+        component.last_error = reason
+        component.task = None
+        component.restart_at = now + delay
+        logging.error(f"{component.name} failed ({reason}); restarting in {delay:.1f}s")
+
+
+supervisor = Supervisor()
@@ -0,0 +1,160 @@
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+import wave
+
+
+def wav_duration_ms(audio):
+    with wave.open(io.BytesIO(audio), "rb") as wav:
+        return int(wav.getnframes() * 1000 / wav.getframerate())
+
+
+class Voice:
+    def __init__(self, id, name, languages=()):
+        self.id = id
+        self.name = name
+        self.languages = list(languages)
+
+
+class TTSBackend:
+    """
+    Interface between the TTS pipeline and a speech engine. synthesize() turns text into WAV bytes
+    and play() blocks until a clip has finished. synthesize() and list_voices() are only called from
+    the thread that renders; play() is only called from the playback thread.
+    """
+
+    name = "base"
+
+    def list_voices(self):
+        raise NotImplementedError("list_voices method not implemented.")
+
+    def synthesize(self, text, voice_id, volume):
+        raise NotImplementedError("synthesize method not implemented.")
+
+    def play(self, audio):
+        raise NotImplementedError("play method not implemented.")
+
+    def duration(self, audio):
+        return wav_duration_ms(audio)
+
+
+class Pyttsx3Backend(TTSBackend):
+    """Renders with pyttsx3 and plays through the speakers with pydub. The engine is created on first use."""
+
+    name = "pyttsx3"
+
+    def __init__(self):
+        self._engine = None
+        self._voice = None
+        self._volume = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            import pyttsx3
+
+            self._engine = pyttsx3.init()
+        return self._engine
+
+    def list_voices(self):
+        return self.engine.getProperty('voices')
+
+    def synthesize(self, text, voice_id, volume):
+        # Switching voice is slow on some drivers, so only touch the engine when something changed
+        if voice_id != self._voice:
+            self.engine.setProperty('voice', voice_id)
+            self._voice = voice_id
+        if volume != self._volume:
+            self.engine.setProperty('volume', volume)
+            self._volume = volume
+
+        fd, path = tempfile.mkstemp(suffix=".wav", prefix="tts_")
+        os.close(fd)
+        try:
+            self.engine.save_to_file(text, path)
+            self.engine.runAndWait()
+            with open(path, "rb") as f:
+                return f.read()
+        finally:
+            os.remove(path)
+
+    def play(self, audio):
+        from pydub import AudioSegment
+        from pydub.playback import play
+
+        play(AudioSegment.from_wav(io.BytesIO(audio)))
+
+
+class NullBackend(TTSBackend):
+    """
+    Simulates a speech engine without any audio device: synthesize() sleeps for a render time
+    proportional to the text and returns silent WAV of a plausible length, and play() sleeps for
+    the clip's length divided by playback_speed. Used to load-test chat handling headless.
+    """
+
+    name = "null"
+    SAMPLE_RATE = 8000
+
+    def __init__(self, ms_per_word=350, synthesis_ms_per_char=0.5, playback_speed=1.0):
+        self.ms_per_word = ms_per_word
+        self.synthesis_ms_per_char = synthesis_ms_per_char
+        self.playback_speed = playback_speed
+
+    def list_voices(self):
+        return [Voice("null-voice-1", "Null Voice 1", ["en"]), Voice("null-voice-2", "Null Voice 2", ["en"])]
+
+    def synthesize(self, text, voice_id, volume):
+        time.sleep(len(text) * self.synthesis_ms_per_char / 1000)
+
+        frames = int(max(1, len(text.split())) * self.ms_per_word * self.SAMPLE_RATE / 1000)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(1)
+            wav.setframerate(self.SAMPLE_RATE)
+            wav.writeframes(b"\x80" * frames)  # 8-bit silence
+        return buffer.getvalue()
+
+    def play(self, audio):
+        time.sleep(self.duration(audio) / 1000 / self.playback_speed)
+
+
+class FileBackend(TTSBackend):
+    """Synthesizes with another backend but writes every played clip to a directory instead of the speakers."""
+
+    name = "file"
+
+    def __init__(self, directory, source=None):
+        self.directory = directory
+        self.source = source or Pyttsx3Backend()
+        self._count = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def list_voices(self):
+        return self.source.list_voices()
+
+    def synthesize(self, text, voice_id, volume):
+        return self.source.synthesize(text, voice_id, volume)
+
+    def play(self, audio):
+        with self._lock:
+            self._count += 1
+            path = os.path.join(self.directory, f"tts_{int(time.time())}_{self._count:05d}.wav")
+        with open(path, "wb") as f:
+            f.write(audio)
+        logging.info(f"TTS clip written to {path}")
+
+
+def create_backend(name, output_directory="tts_output"):
+    name = (name or "pyttsx3").lower()
+    if name == "null":
+        return NullBackend()
+    if name == "file":
+        return FileBackend(output_directory)
+    if name != "pyttsx3":
+        logging.warning(f"Unknown TTS_Backend '{name}', using pyttsx3")
+    return Pyttsx3Backend()
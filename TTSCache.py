@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from config import load_settings
+
+settings = load_settings("settings.json")
+TTS_Cache_Size_MB = float(settings.get("TTS_Cache_Size_MB", 32))
+TTS_Cache_Directory = settings.get("TTS_Cache_Directory", "")
+TTS_Cache_Disk_Size_MB = float(settings.get("TTS_Cache_Disk_Size_MB", 256))
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+def cache_key(voice_id, volume, text):
+    raw = f"{voice_id}\0{round(float(volume), 3)}\0{normalize_text(text)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed cache of rendered TTS audio keyed on (voice id, volume, normalized text).
+    Keeps the most recently used clips in memory within a byte budget, and optionally spills
+    evicted clips to a directory so they can be reloaded instead of re-synthesized.
+    """
+
+    def __init__(self, max_bytes, directory="", max_disk_bytes=0):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._disk_size = sum(os.path.getsize(path) for path in self._disk_files())
+
+    def get(self, key):
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        audio = self._read_disk(key)
+        if audio is not None:
+            self.disk_hits += 1
+            self.put(key, audio)
+            return audio
+
+        self.misses += 1
+        return None
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+            self._entries[key] = audio
+            self._size += len(audio)
+            while self._size > self.max_bytes:
+                old_key, old_audio = self._entries.popitem(last=False)
+                self._size -= len(old_audio)
+                evicted.append((old_key, old_audio))
+
+        for old_key, old_audio in evicted:
+            self._spill(old_key, old_audio)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "disk_bytes": self._disk_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses
+            }
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.wav")
+
+    def _disk_files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".wav")]
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Could not read cached TTS clip {key}: {e}")
+            return None
+
+    def _spill(self, key, audio):
+        if not self.directory:
+            return
+
+        path = self._path(key)
+        try:
+            if os.path.exists(path):
+                return
+            with open(path, "wb") as f:
+                f.write(audio)
+            self._disk_size += len(audio)
+            if self._disk_size > self.max_disk_bytes:
+                self._prune_disk()
+        except OSError as e:
+            logging.warning(f"Could not write cached TTS clip {key}: {e}")
+
+    def _prune_disk(self):
+        # Remove the least recently written clips until the directory is back under budget
+        files = sorted(self._disk_files(), key=os.path.getmtime)
+        for path in files:
+            if self._disk_size <= self.max_disk_bytes:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self._disk_size -= size
+
+
+tts_cache = TTSCache(
+    max_bytes=int(TTS_Cache_Size_MB * 1024 * 1024),
+    directory=TTS_Cache_Directory,
+    max_disk_bytes=int(TTS_Cache_Disk_Size_MB * 1024 * 1024)
+)
@@ -4,10 +4,81 @@ import json
 import asyncio
 import time
 
+from BotLoop import running_on
 from config import load_settings
+from Supervisor import supervisor
 
 OBS_Bobble_image = load_settings("settings.json")["OBS_Bobble_image"]
-connected_clients = set()  # WebSocket clients set
+connected_clients = set()  # WebSocket clients set, only touched on the server's loop
+
+
+class BroadcastChannel:
+    """
+    Hands payloads for the browser source to the WebSocket server's loop. post() can be called from
+    any thread or loop and never waits; a single task on the server loop sends each payload to
+    every connected client, so sockets are only ever used by the loop that owns them. Payloads
+    posted before the server starts, or while the queue is full, are dropped.
+    """
+
+    def __init__(self, max_pending=1000, send_timeout=5):
+        self.max_pending = max_pending
+        self.send_timeout = send_timeout
+        self.posted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self._loop = None
+        self._queue = None
+
+    async def run(self):
+        """Fans posted payloads out to the clients. Runs on the server's loop until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.max_pending)
+        while True:
+            supervisor.heartbeat("WebSocketServer")
+            try:
+                payload = await asyncio.wait_for(self._queue.get(), 30)
+            except asyncio.TimeoutError:
+                continue
+            if not connected_clients:
+                continue
+            message_data = json.dumps(payload)
+            results = await asyncio.gather(*(asyncio.wait_for(client.send(message_data), self.send_timeout)
+                                             for client in list(connected_clients)), return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.failed += 1
+                    logging.warning(f"Failed to send to a WebSocket client: {result!r}")
+                else:
+                    self.sent += 1
+
+    def post(self, payload):
+        if self._loop is None or self._loop.is_closed():
+            self.dropped += 1
+            return
+        self.posted += 1
+        if running_on(self._loop):
+            self._put(payload)
+        else:
+            self._loop.call_soon_threadsafe(self._put, payload)
+
+    def stats(self):
+        return {
+            "posted": self.posted,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pending": self._queue.qsize() if self._queue else 0
+        }
+
+    def _put(self, payload):
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+broadcast_channel = BroadcastChannel()
 
 # Start WebSocket server to handle real-time messaging
 async def websocket_handler(websocket):
@@ -29,8 +100,8 @@ async def websocket_handler(websocket):
         logging.info("Client disconnected")
 
 
-# Broadcast function to send messages (and optionally vote) to all clients
-async def broadcast_message(username, message, duration):
+# Post a TTS message (and optionally vote) to all clients; safe to call from any thread
+def post_message(username, message, duration, message_id=None):
     is_sub = False
 
     sub_keywords = [
@@ -41,30 +112,28 @@ async def broadcast_message(username, message, duration):
     if any(keyword in message.lower() for keyword in sub_keywords):
         is_sub = True
 
-    if connected_clients:
-        payload = {
-            "username": username.strip(),
-            "message": message.strip(),
-            "isSub": is_sub,
-            "duration": duration
-        }
-
-        message_data = json.dumps(payload)
-        logging.info(f"Message payload: {message_data}")
+    payload = {
+        "event": "started",
+        "id": message_id,
+        "username": username.strip(),
+        "message": message.strip(),
+        "isSub": is_sub,
+        "duration": duration
+    }
+    logging.info(f"Message payload: {payload}")
+    broadcast_channel.post(payload)
 
-        await asyncio.gather(*(client.send(message_data) for client in connected_clients))
 
+async def broadcast_message(username, message, duration, message_id=None):
+    post_message(username, message, duration, message_id)
 
 
-async def update_latest_message(username, message, duration):
-    logging.info("Sending latest message to WebSocket clients...")
-    try:
-        await broadcast_message(username, message, duration)
-    except Exception as e:
-        logging.error(f"Failed to send latest message: {e}")
+# Tell clients a message has finished playing so they can hide it without waiting for the duration
+def post_playback_finished(message_id):
+    broadcast_channel.post({"event": "finished", "id": message_id})
 
 
 async def start_websocket_server():
     async with websockets.serve(websocket_handler, "localhost", 8080):
         logging.info("WebSocket server started on ws://localhost:8080")
-        await asyncio.Future()  # Run forever
+        await broadcast_channel.run()  # Run forever
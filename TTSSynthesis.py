@@ -0,0 +1,196 @@
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from TTSBackends import create_backend
+
+
+def _worker_main(index, backend_name, jobs, results):
+    """Entry point of a synthesis process: owns its own backend and renders jobs until told to stop."""
+    try:
+        backend = create_backend(backend_name)
+        backend.list_voices()  # forces the engine to start now rather than on the first job
+    except Exception as e:
+        results.put(("failed", index, None, f"Could not initialise TTS engine: {e}"))
+        return
+
+    results.put(("ready", index, None, None))
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        job_id, text, voice_id, volume = job
+        results.put(("started", index, job_id, None))
+        try:
+            results.put(("done", index, job_id, backend.synthesize(text, voice_id, volume)))
+        except Exception as e:
+            results.put(("error", index, job_id, str(e)))
+
+
+class SynthesisPool:
+    """
+    Pool of processes that each own a TTS backend (and so their own engine) and turn text into
+    WAV bytes, so synthesis uses several cores and one stuck render can't stall the bot.
+    submit() returns a Future.
+
+    A monitor thread restarts workers that die or take longer than job_timeout on a single job;
+    the job they were holding fails with a TimeoutError instead of blocking playback. If the engine
+    can't start in any worker, or the pool is stopped, pending and new jobs fail straight away.
+    """
+
+    def __init__(self, workers, backend_name="pyttsx3", job_timeout=15):
+        self.size = max(1, workers)
+        self.backend_name = backend_name
+        self.job_timeout = job_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs = self._context.Queue()
+        self._results = self._context.Queue()
+        self._processes = {}
+        self._running = {}  # worker index -> (job id, started at)
+        self._broken = set()  # workers whose engine could not start, not worth restarting
+        self._futures = {}
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def start(self):
+        for index in range(self.size):
+            self._spawn(index)
+        self._threads = [
+            threading.Thread(target=self._collect_results, name="TTSSynthesisResults", daemon=True),
+            threading.Thread(target=self._monitor, name="TTSSynthesisMonitor", daemon=True)
+        ]
+        for t in self._threads:
+            t.start()
+        logging.info(f"TTS synthesis pool started with {self.size} worker processes")
+
+    def stop(self):
+        self._stop_event.set()
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._fail_all(RuntimeError("TTS synthesis pool stopped"))
+
+    def submit(self, text, voice_id, volume):
+        future = Future()
+        if self._stop_event.is_set() or self._all_broken():
+            future.set_exception(RuntimeError("No TTS synthesis worker is available"))
+            return future
+
+        job_id = next(self._job_ids)
+        with self._lock:
+            self._futures[job_id] = future
+        self._jobs.put((job_id, text, voice_id, volume))
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.size,
+                "alive": sum(1 for p in self._processes.values() if p.is_alive()),
+                "busy": len(self._running),
+                "pending": len(self._futures),
+                "completed": self.completed,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "restarts": self.restarts
+            }
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.backend_name, self._jobs, self._results),
+            name=f"TTSSynthesis-{index}",
+            daemon=True
+        )
+        process.start()
+        self._processes[index] = process
+
+    def _finish(self, job_id, audio=None, error=None):
+        with self._lock:
+            future = self._futures.pop(job_id, None)
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(audio)
+
+    def _all_broken(self):
+        return len(self._broken) >= self.size
+
+    def _fail_all(self, error):
+        with self._lock:
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _collect_results(self):
+        while not self._stop_event.is_set():
+            try:
+                kind, index, job_id, payload = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            if kind == "ready":
+                logging.info(f"TTS synthesis worker {index} ready")
+            elif kind == "failed":
+                logging.error(f"TTS synthesis worker {index}: {payload}")
+                self._broken.add(index)
+                if self._all_broken():
+                    logging.error("No TTS synthesis worker could start its engine, failing queued jobs")
+                    self._fail_all(RuntimeError("No TTS synthesis worker is available"))
+            elif kind == "started":
+                with self._lock:
+                    self._running[index] = (job_id, time.time())
+            elif kind == "done":
+                with self._lock:
+                    self._running.pop(index, None)
+                    self.completed += 1
+                self._finish(job_id, audio=payload)
+            elif kind == "error":
+                with self._lock:
+                    self._running.pop(index, None)
+                    self.errors += 1
+                self._finish(job_id, error=RuntimeError(payload))
+
+    def _monitor(self):
+        while not self._stop_event.wait(1):
+            now = time.time()
+            for index, process in list(self._processes.items()):
+                with self._lock:
+                    running = self._running.get(index)
+
+                hung = running is not None and now - running[1] > self.job_timeout
+                if (process.is_alive() and not hung) or index in self._broken:
+                    continue
+
+                if hung:
+                    self.timeouts += 1
+                    logging.warning(f"TTS synthesis worker {index} hung for {now - running[1]:.1f}s, restarting")
+                    process.terminate()
+                    process.join(timeout=5)
+                else:
+                    logging.warning(f"TTS synthesis worker {index} exited with code {process.exitcode}, restarting")
+
+                with self._lock:
+                    self._running.pop(index, None)
+                if running is not None:
+                    self._finish(running[0], error=TimeoutError(f"TTS synthesis worker {index} stopped responding"))
+
+                self.restarts += 1
+                self._spawn(index)
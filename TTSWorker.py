@@ -0,0 +1,546 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future
+
+from TTSCache import tts_cache, cache_key
+from TTSObsWebsocket import post_message, post_playback_finished
+from TTSBackends import create_backend, wav_duration_ms
+from TTSSynthesis import SynthesisPool
+from config import load_settings
+from Supervisor import supervisor
+from BotLoop import bot_loop
+
+# Lower number is spoken first
+PRIORITY_ALERT = 0  # subs, gifted subs, raids, bits
+PRIORITY_SHOUT = 1  # !shout
+PRIORITY_CHAT = 2   # normal chat and !lurk
+
+settings = load_settings("settings.json")
+TTS_Backend = settings.get("TTS_Backend", "pyttsx3")
+TTS_Output_Directory = settings.get("TTS_Output_Directory", "tts_output")
+OBS_Browser_Source = settings.get("OBS_Browser_Source", False)
+TTS_Random_Voice = settings.get("TTS_Random_Voice", False)
+TTS_Voice = int(settings.get("TTS_Voice", 0))
+TTS_Max_Queue_Depth = int(settings.get("TTS_Max_Queue_Depth", 50))
+TTS_Lookahead = int(settings.get("TTS_Lookahead", 2))
+TTS_Max_Queue_Age = float(settings.get("TTS_Max_Queue_Age", 30))
+TTS_Overload_Mode = settings.get("TTS_Overload_Mode", "drop-oldest").lower()
+TTS_Overload_Threshold = int(settings.get("TTS_Overload_Threshold", 20))
+TTS_Overload_Sample_Rate = int(settings.get("TTS_Overload_Sample_Rate", 3))
+TTS_Synthesis_Workers = int(settings.get("TTS_Synthesis_Workers", 0))
+TTS_Synthesis_Timeout = float(settings.get("TTS_Synthesis_Timeout", 15))
+TTS_Max_Chars = int(settings.get("TTS_Max_Chars", 300))
+TTS_Max_Seconds = float(settings.get("TTS_Max_Seconds", 20))
+
+MIN_CHUNK_CHARS = 30   # clauses shorter than this are merged into the next one
+MAX_CHUNK_CHARS = 200  # chunks longer than this are split between words
+
+OVERLOAD_MODES = ("drop-oldest", "drop-newest", "sample")
+
+_request_ids = itertools.count(1)
+
+
+class TTSRequest:
+    def __init__(self, username, message, text, volume, priority, prefix=None):
+        self.id = next(_request_ids)
+        self.username = username
+        self.message = message
+        self.text = text
+        self.volume = volume
+        self.priority = priority
+        self.prefix = prefix  # the speaker's name the text starts with, if any
+        self.enqueued_at = time.time()
+
+
+def split_into_chunks(text, min_chars=MIN_CHUNK_CHARS, max_chars=MAX_CHUNK_CHARS):
+    """Splits text at sentence and clause boundaries into chunks that can be rendered and played one by one."""
+    chunks = []
+    current = ""
+    for clause in re.split(r"(?<=[.!?;:,])\s+", text.strip()):
+        current = f"{current} {clause}".strip()
+        while len(current) > max_chars:
+            cut = current.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            chunks.append(current[:cut].strip())
+            current = current[cut:].strip()
+        if len(current) >= min_chars:
+            chunks.append(current)
+            current = ""
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def truncate_text(text, max_chars):
+    if not max_chars or len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[:cut if cut > 0 else max_chars]
+
+
+class PendingClip:
+    def __init__(self, request, chunks):
+        self.request = request
+        self.chunks = chunks
+        self.futures = [Future() for _ in chunks]  # each resolves to the chunk's WAV file contents
+
+
+class RenderedClip:
+    def __init__(self, request, audio):
+        self.request = request
+        self.audio = audio  # WAV file contents
+        self.duration = wav_duration_ms(audio)
+
+
+class TTSQueue:
+    """
+    Bounded priority queue with a load-shedding policy so TTS never falls far behind chat.
+
+    - Requests older than max_age seconds are dropped when they reach the front of the queue.
+    - When the queue is full, "drop-oldest" evicts the oldest of the least urgent queued requests
+      and "drop-newest" rejects the newcomer. A more urgent request always evicts a less urgent one.
+    - In "sample" mode, once threshold requests are waiting only 1 in sample_rate chat messages is
+      accepted until the queue drains below the threshold again.
+
+    Sub/raid alerts are never expired or sampled. Shed counts are kept per reason in `shed`.
+    """
+
+    def __init__(self, max_depth, max_age=0, mode="drop-oldest", threshold=0, sample_rate=1):
+        if mode not in OVERLOAD_MODES:
+            logging.warning(f"Unknown TTS_Overload_Mode '{mode}', using drop-oldest")
+            mode = "drop-oldest"
+
+        self.max_depth = max(1, max_depth)
+        self.max_age = max_age
+        self.mode = mode
+        self.threshold = threshold
+        self.sample_rate = max(1, sample_rate)
+        self._heap = []
+        self._counter = itertools.count()
+        self._sample_counter = 0
+        self._condition = threading.Condition()
+        self.enqueued = 0
+        self.shed = {"queue_full": 0, "expired": 0, "sampled": 0}
+
+    @property
+    def dropped(self):
+        return sum(self.shed.values())
+
+    def put(self, request):
+        with self._condition:
+            if self._should_sample_out(request):
+                self.shed["sampled"] += 1
+                logging.info(f"TTS overloaded, sampled out message from {request.username}")
+                return False
+
+            if len(self._heap) >= self.max_depth:
+                victim = self._choose_victim(request)
+                if victim is None:
+                    self.shed["queue_full"] += 1
+                    logging.warning(f"TTS queue full ({self.max_depth}), dropped message from {request.username}")
+                    return False
+
+                self._heap.remove(victim)
+                heapq.heapify(self._heap)
+                self.shed["queue_full"] += 1
+                logging.warning(f"TTS queue full ({self.max_depth}), evicted message from {victim[2].username}")
+
+            heapq.heappush(self._heap, (request.priority, next(self._counter), request))
+            self.enqueued += 1
+            self._condition.notify()
+            return True
+
+    def get(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                while not self._heap:
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+
+                request = heapq.heappop(self._heap)[2]
+                if self._shed_if_expired(request):
+                    continue
+                return request
+
+    def expired(self, request):
+        """Counts and logs a request that went stale after leaving the queue (e.g. waiting for playback)."""
+        with self._condition:
+            return self._shed_if_expired(request)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _should_sample_out(self, request):
+        if self.mode != "sample" or request.priority == PRIORITY_ALERT:
+            return False
+        if len(self._heap) < self.threshold:
+            self._sample_counter = 0
+            return False
+
+        self._sample_counter += 1
+        return self._sample_counter % self.sample_rate != 0
+
+    def _choose_victim(self, request):
+        # Only requests no more urgent than the newcomer may be evicted
+        least_urgent = max(entry[0] for entry in self._heap)
+        if least_urgent < request.priority:
+            return None
+        if least_urgent == request.priority and self.mode != "drop-oldest":
+            return None
+
+        candidates = [entry for entry in self._heap if entry[0] == least_urgent]
+        if least_urgent > request.priority and self.mode != "drop-oldest":
+            return max(candidates)
+        return min(candidates)
+
+    def _shed_if_expired(self, request):
+        if not self._is_expired(request):
+            return False
+        self.shed["expired"] += 1
+        logging.info(f"TTS message from {request.username} expired after "
+                     f"{time.time() - request.enqueued_at:.1f}s")
+        return True
+
+    def _is_expired(self, request):
+        if not self.max_age or request.priority == PRIORITY_ALERT:
+            return False
+        return time.time() - request.enqueued_at > self.max_age
+
+
+class VoicePool:
+    """
+    Resolves the engine's voices once and hands out voice ids without touching the engine.
+    With TTS_Random_Voice every chatter gets their own voice, picked from a hash of their
+    username so they keep it for the whole stream and across restarts.
+    """
+
+    def __init__(self, voices, random_voice=TTS_Random_Voice, voice_index=TTS_Voice):
+        self.voices = list(voices)
+        self.random_voice = random_voice
+        if 0 <= voice_index < len(self.voices):
+            self.default_voice = self.voices[voice_index]
+        else:
+            self.default_voice = self.voices[0]  # fallback to first if index out of range
+
+    def voice_for(self, username):
+        if not self.random_voice:
+            return self.default_voice
+        return self.voices[zlib.crc32(username.strip().lower().encode("utf-8")) % len(self.voices)]
+
+
+class TTSWorker:
+    """
+    Two-stage TTS pipeline. The render thread takes queued requests in priority order and renders
+    them to WAV, staying up to `lookahead` clips ahead of the playback thread, so the next message
+    is ready the moment the current one finishes.
+
+    Messages are split into sentence/clause chunks and streamed: playback starts on the first
+    chunk while the rest are still rendering, and stops early once max_seconds have been spoken.
+
+    The speech engine sits behind a TTSBackend (pyttsx3, file or null). With synthesis_workers at 0
+    the render thread synthesizes with the backend itself. Otherwise it hands synthesis to a
+    SynthesisPool of backend processes, so the look-ahead clips render in parallel, and playback
+    waits on each clip in order.
+    """
+
+    def __init__(self, backend=None, max_depth=TTS_Max_Queue_Depth, lookahead=TTS_Lookahead,
+                 synthesis_workers=TTS_Synthesis_Workers, synthesis_timeout=TTS_Synthesis_Timeout,
+                 max_chars=TTS_Max_Chars, max_seconds=TTS_Max_Seconds):
+        self.queue = TTSQueue(
+            max_depth,
+            max_age=TTS_Max_Queue_Age,
+            mode=TTS_Overload_Mode,
+            threshold=TTS_Overload_Threshold,
+            sample_rate=TTS_Overload_Sample_Rate
+        )
+        self.rendered = queue.Queue(maxsize=max(1, lookahead))
+        self.rendered_count = 0
+        self.played = 0
+        self.failed = 0
+        self.played_ms = 0
+        self._recent_plays = deque()  # (finished_at, duration_ms) over the last minute
+        self.max_chars = max_chars
+        self.max_ms = int(max_seconds * 1000)
+        self.cut_short = 0
+        self._first_audio_ms = deque(maxlen=100)  # time from enqueue to first audio, recent messages
+        self.synthesis_workers = synthesis_workers
+        self.synthesis_timeout = synthesis_timeout
+        self.synthesis_pool = None
+        self.voice_pool = None
+        self.backend = backend or create_backend(TTS_Backend, TTS_Output_Directory)
+        self._threads = []
+        self._beats = {}  # thread name -> last time round its loop, for watch()
+        self._start_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def start(self):
+        with self._start_lock:
+            if self._threads and not self._stop_event.is_set() and all(t.is_alive() for t in self._threads):
+                return
+            # Each generation of threads gets its own stop event, so a stuck thread from an earlier
+            # one still exits when it wakes up instead of running alongside its replacement
+            self._stop_event.set()
+            self._stop_event = stop_event = threading.Event()
+            now = time.monotonic()
+            self._beats = {"TTSRenderer": now, "TTSPlayback": now}
+            self._threads = [
+                threading.Thread(target=self._render_loop, args=(stop_event,), name="TTSRenderer", daemon=True),
+                threading.Thread(target=self._playback_loop, args=(stop_event,), name="TTSPlayback", daemon=True)
+            ]
+            for t in self._threads:
+                t.start()
+
+    def stop(self):
+        self._stop_event.set()
+        for t in self._threads:
+            t.join(timeout=5)
+        if self.synthesis_pool:
+            self.synthesis_pool.stop()
+
+    async def watch(self, stale_after=120):
+        """
+        Supervisor component: starts the threads and heartbeats while both are alive and getting
+        round their loops, and raises if one has died or been stuck for stale_after seconds.
+        """
+        self.start()
+        try:
+            while True:
+                await asyncio.sleep(1)
+                now = time.monotonic()
+                for t in self._threads:
+                    if not t.is_alive():
+                        raise RuntimeError(f"{t.name} thread died")
+                    if now - self._beats.get(t.name, now) > stale_after:
+                        raise RuntimeError(f"{t.name} thread stuck for {now - self._beats[t.name]:.0f}s")
+                supervisor.heartbeat("TTSWorker")
+        finally:
+            self._stop_event.set()
+            pool, self.synthesis_pool = self.synthesis_pool, None
+            if pool:
+                await bot_loop.run_blocking(pool.stop)
+
+    def enqueue(self, request):
+        self.start()
+        return self.queue.put(request)
+
+    def stats(self):
+        cutoff = time.time() - 60
+        recent = [duration for finished_at, duration in list(self._recent_plays) if finished_at >= cutoff]
+        return {
+            "depth": len(self.queue),
+            "rendered_ahead": self.rendered.qsize(),
+            "enqueued": self.queue.enqueued,
+            "dropped": self.queue.dropped,
+            "shed": dict(self.queue.shed),
+            "rendered": self.rendered_count,
+            "played": self.played,
+            "failed": self.failed,
+            "played_ms": self.played_ms,
+            "cut_short": self.cut_short,
+            "time_to_first_audio_ms": {
+                "last": self._first_audio_ms[-1] if self._first_audio_ms else None,
+                "avg": sum(self._first_audio_ms) / len(self._first_audio_ms) if self._first_audio_ms else None,
+                "max": max(self._first_audio_ms) if self._first_audio_ms else None
+            },
+            "messages_per_minute": len(recent),
+            "audio_seconds_per_minute": sum(recent) / 1000,
+            "cache": tts_cache.stats(),
+            "synthesis_pool": self.synthesis_pool.stats() if self.synthesis_pool else None
+        }
+
+    def _init_engine(self):
+        # The engine is created on the render thread so that only this thread ever drives it
+        voices = self.backend.list_voices()
+        logging.info("Available TTS voices:")
+        for i, voice in enumerate(voices):
+            logging.info(f"  [{i}] Name: {voice.name}, ID: {voice.id}, Lang: {voice.languages}")
+        self.voice_pool = VoicePool(voices)
+
+        if self.synthesis_workers > 0:
+            # A pool left over from an earlier generation of threads would keep its processes running
+            if self.synthesis_pool:
+                self.synthesis_pool.stop()
+            self.synthesis_pool = SynthesisPool(self.synthesis_workers, self.backend.name, self.synthesis_timeout)
+            self.synthesis_pool.start()
+
+    def _prepare(self, request):
+        text = truncate_text(request.text, self.max_chars)
+        # The name up front is usually the only per-user part, so it gets a chunk of its own and the
+        # rest ("subbed, thank you very much for the sub!", copypasta) is cached across users
+        prefix = request.prefix
+        if prefix and text.lower().startswith(prefix.lower() + " "):
+            return PendingClip(request, [text[:len(prefix)]] + split_into_chunks(text[len(prefix):]))
+        return PendingClip(request, split_into_chunks(text))
+
+    def _render(self, pending):
+        voice = self.voice_pool.voice_for(pending.request.username)
+        volume = pending.request.volume
+
+        for chunk, future in zip(pending.chunks, pending.futures):
+            # Skipped when playback already cut the message short
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            key = cache_key(voice.id, volume, chunk)
+            audio = tts_cache.get(key)
+            if audio is not None:
+                future.set_result(audio)
+            elif self.synthesis_pool:
+                self.synthesis_pool.submit(chunk, voice.id, volume).add_done_callback(
+                    lambda f, key=key, future=future: self._resolve(key, future, f))
+            else:
+                try:
+                    audio = self.backend.synthesize(chunk, voice.id, volume)
+                    tts_cache.put(key, audio)
+                    future.set_result(audio)
+                except Exception as e:
+                    future.set_exception(e)
+
+    def _resolve(self, key, future, synthesized):
+        if synthesized.exception() is not None:
+            future.set_exception(synthesized.exception())
+            return
+        tts_cache.put(key, synthesized.result())
+        future.set_result(synthesized.result())
+
+    def _play(self, pending):
+        request = pending.request
+        spoken_ms = 0
+        started = False
+        try:
+            for index, future in enumerate(pending.futures):
+                # A hung synthesis process is failed by the pool's monitor well within this
+                clip = RenderedClip(request, future.result(timeout=self.synthesis_timeout * 2))
+                self.rendered_count += 1
+
+                if started and self.max_ms and spoken_ms + clip.duration > self.max_ms:
+                    self.cut_short += 1
+                    logging.info(f"TTS message from {request.username} cut short after {spoken_ms / 1000:.1f}s")
+                    for later in pending.futures[index:]:
+                        later.cancel()
+                    break
+
+                if not started:
+                    started = True
+                    self._first_audio_ms.append(int((time.time() - request.enqueued_at) * 1000))
+                    if OBS_Browser_Source:
+                        post_message(request.username, request.message, self._known_duration(pending), request.id)
+
+                self.backend.play(clip.audio)
+                spoken_ms += clip.duration
+        finally:
+            if started:
+                self._record_play(spoken_ms)
+                if OBS_Browser_Source:
+                    post_playback_finished(request.id)
+
+    def _known_duration(self, pending):
+        # Length of the chunks rendered so far; the overlay hides the message on the finished event anyway
+        duration = 0
+        for future in pending.futures:
+            if not future.done() or future.cancelled() or future.exception() is not None:
+                break
+            duration += self.backend.duration(future.result())
+        if self.max_ms:
+            duration = min(duration, self.max_ms)
+        return duration
+
+    def _record_play(self, duration):
+        now = time.time()
+        self.played += 1
+        self.played_ms += duration
+        self._recent_plays.append((now, duration))
+        while self._recent_plays and self._recent_plays[0][0] < now - 60:
+            self._recent_plays.popleft()
+
+    def _render_loop(self, stop_event):
+        try:
+            self._init_engine()
+        except Exception as e:
+            logging.error(f"Could not initialise TTS engine: {e}")
+            return
+
+        logging.info("TTS renderer started")
+        while not stop_event.is_set():
+            self._beats["TTSRenderer"] = time.monotonic()
+            request = self.queue.get(timeout=1)
+            if request is None:
+                continue
+
+            pending = self._prepare(request)
+            if not pending.chunks:
+                continue
+
+            # Blocks while the look-ahead buffer is full. The clip is handed over before it is
+            # rendered so playback can start on its first chunk while later chunks render.
+            while not stop_event.is_set():
+                self._beats["TTSRenderer"] = time.monotonic()
+                try:
+                    self.rendered.put(pending, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+
+            try:
+                self._render(pending)
+            except Exception as e:
+                logging.error(f"Error rendering TTS: {e}")
+                for future in pending.futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+        logging.info("TTS renderer stopped")
+
+    def _playback_loop(self, stop_event):
+        logging.info("TTS playback started")
+        while not stop_event.is_set():
+            self._beats["TTSPlayback"] = time.monotonic()
+            try:
+                pending = self.rendered.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            # The look-ahead buffer can hold a clip long enough for it to go stale
+            if self.queue.expired(pending.request):
+                for future in pending.futures:
+                    future.cancel()
+                continue
+
+            try:
+                self._play(pending)
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Error playing TTS: {e}")
+
+        logging.info("TTS playback stopped")
+
+
+tts_worker = TTSWorker()
+
+
+if __name__ == '__main__':
+    from TTSBackends import NullBackend
+
+    # Headless load test: floods the pipeline through the null backend at 10x playback speed
+    worker = TTSWorker(backend=NullBackend(playback_speed=10))
+    started = time.time()
+    for i in range(500):
+        worker.enqueue(TTSRequest(f"viewer{i % 50}", f"message number {i}", f"viewer{i % 50} says message number {i}, "
+                                  f"with a second clause to chunk", 0.8, PRIORITY_CHAT))
+        time.sleep(0.01)
+    time.sleep(5)
+    print(f"{time.time() - started:.1f}s: {worker.stats()}")
+    worker.stop()
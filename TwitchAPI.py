@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+from HelixClient import helix, PRIORITY_BACKGROUND
+from config import load_settings
+
+HELIX_BATCH_SIZE = 100  # most logins or ids Helix accepts in one request
+
+settings = load_settings("settings.json")
+Twitch_Roles_Refresh_Interval = float(settings.get("Twitch_Roles_Refresh_Interval", 300))
+Twitch_Follower_Preload_Limit = int(settings.get("Twitch_Follower_Preload_Limit", 5000))
+
+
+class UserLookupBatcher:
+    """
+    Batches Helix user lookups. Logins requested within `window` seconds of each other are
+    resolved together, up to 100 per GET /helix/users request, and each caller gets a Future for
+    its own user (the Helix user dict, or None if the login doesn't exist). Asking again for a login
+    whose batch has already been sent returns the same Future rather than queueing it twice.
+    """
+
+    def __init__(self, window=0.25, batch_size=HELIX_BATCH_SIZE):
+        self.window = window
+        self.batch_size = batch_size
+        self._pending = {}  # login -> Future, not sent yet
+        self._in_flight = {}  # login -> Future, sent and waiting for Helix
+        self._lock = threading.Lock()
+        self._timer = None
+        self.lookups = 0
+        self.requests = 0
+
+    def lookup(self, login):
+        login = login.strip().lower()
+        with self._lock:
+            future = self._pending.get(login) or self._in_flight.get(login)
+            if future is not None:
+                return future
+            future = self._pending[login] = Future()
+            self.lookups += 1
+
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+            elif self._timer is None:
+                # Runs on the Helix client's loop like the lookups themselves, instead of a thread per batch
+                self._timer = helix.submit(self._flush_later())
+        return future
+
+    def lookup_many(self, logins):
+        return {login: self.lookup(login) for login in logins}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "requests": self.requests,
+                "requests_saved": self.lookups - self.requests,
+                "batch_fill_ratio": self.lookups / (self.requests * self.batch_size) if self.requests else 0
+            }
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        with self._lock:
+            self._timer = None
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, {}
+        if batch:
+            self._in_flight.update(batch)
+            self.requests += 1
+            helix.submit(self._resolve(batch)).add_done_callback(self._log_failure)
+
+    async def _resolve(self, batch):
+        try:
+            response = await helix.get("/users", params=[("login", login) for login in batch], priority=PRIORITY_BACKGROUND)
+            response.raise_for_status()
+            users = {user["login"].lower(): user for user in response.json().get("data", [])}
+            logging.info(f"Resolved {len(users)}/{len(batch)} Twitch users in one request")
+        except Exception as e:
+            logging.error(f"Error looking up Twitch users {list(batch)}: {e}")
+            self._done(batch)
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._done(batch)
+        for login, future in batch.items():
+            if not future.done():  # a caller may have cancelled it
+                future.set_result(users.get(login))
+
+    @staticmethod
+    def _log_failure(resolved):
+        if not resolved.cancelled() and resolved.exception() is not None:
+            logging.error(f"Twitch user lookup batch failed: {resolved.exception()!r}")
+
+    def _done(self, batch):
+        with self._lock:
+            for login in batch:
+                self._in_flight.pop(login, None)
+
+
+class ChannelRoles:
+    """
+    In-memory sets of the channel's subscriber, moderator and follower user ids, loaded with the
+    broadcaster's paginated list endpoints at startup and refreshed in the background, so a
+    viewer's status is a set lookup instead of three Helix calls.
+
+    Each is_* method returns None when the answer isn't known (the list failed to load, e.g. a
+    missing scope, or the follower list was bigger than follower_limit), and callers should then
+    fall back to asking Helix about that one user.
+    """
+
+    def __init__(self, refresh_interval=Twitch_Roles_Refresh_Interval, follower_limit=Twitch_Follower_Preload_Limit):
+        self.refresh_interval = refresh_interval
+        self.follower_limit = follower_limit
+        self.broadcaster_id = None
+        self.subscribers = None
+        self.sub_tiers = {}  # user id -> 1, 2 or 3
+        self.moderators = None
+        self.followers = None
+        self.followers_complete = False
+        self.requests = 0
+        self._listeners = []
+        self._task = None
+
+    def configure(self, broadcaster_id):
+        self.broadcaster_id = broadcaster_id
+
+    def add_listener(self, callback):
+        """Registers a function called with this object after every refresh."""
+        self._listeners.append(callback)
+
+    async def start(self):
+        """Loads the lists, then keeps refreshing them in a task on the running loop."""
+        await self.refresh()
+        if (self._task is None or self._task.done()) and self.refresh_interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self._refresh_loop(), name="ChannelRolesRefresh")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def refresh(self):
+        params = {"broadcaster_id": self.broadcaster_id}
+
+        subscriptions = await self._fetch("/subscriptions", params)
+        if subscriptions is not None:
+            self.subscribers = set(subscriptions)
+            self.sub_tiers = {user_id: int(entry.get("tier", "1000")) // 1000 for user_id, entry in subscriptions.items()}
+
+        moderators = await self._fetch("/moderation/moderators", params)
+        if moderators is not None:
+            # The broadcaster always has mod-level access
+            self.moderators = set(moderators) | {self.broadcaster_id}
+
+        followers = await self._fetch("/channels/followers", params, limit=self.follower_limit)
+        if followers is not None:
+            self.followers, self.followers_complete = set(followers), len(followers) < self.follower_limit
+
+        logging.info(
+            f"Loaded channel roles: {len(self.subscribers or ())} subs, {len(self.moderators or ())} mods, "
+            f"{len(self.followers or ())} followers{'' if self.followers_complete else ' (partial)'}"
+        )
+        for callback in self._listeners:
+            try:
+                callback(self)
+            except Exception as e:
+                logging.error(f"Error applying channel roles: {e}")
+
+    def is_subscriber(self, user_id):
+        if self.subscribers is None or not user_id:
+            return None
+        return user_id in self.subscribers
+
+    def sub_tier(self, user_id):
+        return self.sub_tiers.get(user_id)
+
+    def is_moderator(self, user_id):
+        if self.moderators is None or not user_id:
+            return None
+        return user_id in self.moderators
+
+    def is_follower(self, user_id):
+        if self.followers is None or not user_id:
+            return None
+        if user_id in self.followers:
+            return True
+        return False if self.followers_complete else None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def _fetch(self, path, params, limit=None):
+        """Loads every page of a broadcaster list endpoint into a dict of user id to entry."""
+        entries = {}
+        cursor = None
+        try:
+            while True:
+                page_params = dict(params, first=HELIX_BATCH_SIZE)
+                if cursor:
+                    page_params["after"] = cursor
+
+                response = await helix.get(path, params=page_params, priority=PRIORITY_BACKGROUND)
+                self.requests += 1
+                if response.status != 200:
+                    logging.warning(f"Could not load {path}: {response.status} - {response.data}")
+                    return None
+
+                data = response.json()
+                entries.update((entry["user_id"], entry) for entry in data.get("data", []))
+                cursor = data.get("pagination", {}).get("cursor")
+                if not cursor or (limit and len(entries) >= limit):
+                    return entries
+        except Exception as e:
+            logging.error(f"Error loading {path}: {e}")
+            return None
+
+
+user_lookups = UserLookupBatcher()
+channel_roles = ChannelRoles()
+
+
+if __name__ == '__main__':
+    import math
+
+    # A NAMES burst: every login is primed with lookup_many, then each viewer asks for its own
+    # login again. Helix should see one request per 100 logins.
+    class FakeResponse:
+        def __init__(self, logins):
+            self._logins = logins
+
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {"data": [{"login": login, "id": str(i)} for i, login in enumerate(self._logins)]}
+
+    async def fake_get(path, params=None, priority=None):
+        await asyncio.sleep(0.05)
+        return FakeResponse([login for _, login in params])
+
+    helix.get = fake_get
+    for count in (1, 100, 250, 1000):
+        batcher = UserLookupBatcher()
+        logins = [f"viewer{i}" for i in range(count)]
+        primed = batcher.lookup_many(logins)
+        again = [batcher.lookup(login) for login in logins]
+        results = [future.result(timeout=5) for future in again]
+        assert all(primed[login] is future for login, future in zip(logins, again))
+        assert all(result["login"] == login for login, result in zip(logins, results))
+        assert batcher.requests == math.ceil(count / 100), batcher.stats()
+        print(f"{count} logins: {batcher.stats()}")
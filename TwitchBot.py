@@ -1,27 +1,30 @@
 import os
-import ssl
+import inspect
 import logging
-import threading
-import irc.client
 import json
 import time
-import asyncio
 
 from BotTTS import text_to_speech
+from TTSWorker import PRIORITY_ALERT
 from Commands import COMMANDS, VoteCommand
 from SoundEffect import play_sound_from_file
 from config import process_settings, sound_effects
-from Viewers import viewers, new_viewer_wrapper, remove_viewer, get_broadcaster_id
+from Viewers import viewers, viewer_lookups, new_viewer, new_viewers, apply_chat_tags, remove_viewer, get_broadcaster_id
+from TwitchAPI import channel_roles
+from HelixClient import helix
+from BotLoop import bot_loop
+from ChatWorkers import chat_workers
+from IRCClient import TwitchIRCClient
+from Supervisor import supervisor
 from Autherisation_URL import autherise
 
 logging.basicConfig(level=logging.INFO)
-shutdown_event = threading.Event()
 
-# Global bot and thread references
+# Global chat client
 bot = None
-irc_thread = None
 
 def on_any_event(connection, event):
+    supervisor.heartbeat("TwitchBot")  # includes the replies to the client's keepalive PINGs
     logging.info(f"Event received: {event.type} - Arguments: {event.arguments}")
 
 def on_connect(connection, event):
@@ -34,34 +37,22 @@ def on_connect(connection, event):
 def on_join(connection, event):
     username = event.source.nick
     logging.info(f"{username} has joined {channel}")
-    if username.lower() != nickname.lower() and username != "own3d":
-        threading.Thread(target=new_viewer_wrapper, args=(username, actual_token, client_id, broadcaster_id)).start()
+    if username.lower() != nickname.lower() and username != "own3d" and username not in viewer_lookups:
+        bot_loop.spawn(new_viewer(username))
 
 def on_part(connection, event):
     username = event.source.nick
     logging.info(f"{username} has left {channel}")
     remove_viewer(username)
 
-def on_ping(connection, event):
-    ping_message = event.arguments[0] if event.arguments else ""
-    logging.info(f"Received PING: {ping_message}")
-    connection.send_raw(f"PONG :{ping_message}")
-
 def on_names(connection, event):
     if event.type == "namreply":
-        usernames = event.arguments[2].split()
-        logging.info(f"usernames: {usernames}")
-        for username in usernames:
-            if username.lower() != nickname.lower() and username != "own3d":
-                threading.Thread(target=new_viewer_wrapper, args=(username, actual_token, client_id, broadcaster_id)).start()
+        usernames = [username for username in event.arguments[2].split()
+                     if username.lower() != nickname.lower() and username != "own3d"]
+        logging.info(f"Received {len(usernames)} usernames in NAMES reply")
+        bot_loop.spawn(new_viewers(usernames))
     elif event.type == "endofnames":
-        logging.info(f"End of NAMES list for {event.arguments[1]}.")
-
-def handle_chat_message_wrapper(connection, username, message):
-    try:
-        asyncio.run(handle_chat_message(connection, username, message))
-    except Exception as e:
-        logging.error(f"Error handling message from {username}: {e}")
+        logging.info(f"End of NAMES list for {event.arguments[0]}.")
 
 async def handle_chat_message(connection, username, message):
     logging.info(f"Handling message from {username}: {message}")
@@ -70,11 +61,13 @@ async def handle_chat_message(connection, username, message):
         command = COMMANDS.get(command_name)
 
         if command:
-            await command.execute(connection, username, message, channel, actual_token, client_id, broadcaster_id)
+            result = command.execute(connection, username, message, channel, actual_token, client_id, broadcaster_id)
+            if inspect.isawaitable(result):  # a few simple commands are plain functions
+                await result
             return
 
         if message.lower() == "get out" and enable_sound_effects:
-            play_sound_from_file(sound_effects, "Tuco-GET-OUT-Sound-Effect.mp3", True)
+            await bot_loop.run_blocking(play_sound_from_file, sound_effects, "Tuco-GET-OUT-Sound-Effect.mp3", True)
             return
 
         if VoteCommand.vote_is_active:
@@ -93,41 +86,52 @@ async def handle_chat_message(connection, username, message):
         logging.error(f"Error handling chat message: {e}")
 
 def on_pubmsg(connection, event):
+    # Each user's messages are handled in order on their shard of the worker pool
+    chat_workers.submit(event.source.nick, handle_pubmsg, connection, event)
+
+async def handle_pubmsg(connection, event):
     username = event.source.nick
     if username == "SoundAlerts":
         return
 
     message = event.arguments[0]
-    user_found = any(username == viewer.username for viewer in viewers)
-
-    if not user_found:
-        threading.Thread(target=new_viewer_wrapper, args=(username, actual_token, client_id, broadcaster_id)).start()
-    threading.Thread(target=handle_chat_message_wrapper, args=(connection, username, message.lower())).start()
+    # Sub and mod status come with the message itself; only follower status needs Helix
+    tags = event.tags
+    if tags.get("user-id"):
+        viewer, needs_follow_check = await apply_chat_tags(username.lower(), tags)
+        if needs_follow_check:
+            bot_loop.spawn(viewer.update_following())
+    elif username not in viewers and username not in viewer_lookups:
+        bot_loop.spawn(new_viewer(username))
+    else:
+        viewers.touch(username.lower())
+    await handle_chat_message(connection, username, message.lower())
 
 def on_privnotice(connection, event):
     message = event.arguments[0] if event.arguments else ""
     logging.warning(f"Privnotice received: {message}")
     if any(err in message.lower() for err in ["login unsuccessful", "authentication failed", "improperly formatted", "invalid nick"]):
-        logging.warning("Invalid token or login issue detected. Attempting reauthorization...")
-        global token
-        token = autherise(client_id, client_secret)
-        if token:
-            logging.info("Reauthorization successful. Reconnecting...")
-            save_token_to_settings(token)
-            connection.close()
-            reconnect_bot()
-        else:
-            logging.error("Reauthorization failed. Exiting.")
-            shutdown_event.set()
+        bot_loop.spawn(reauthorise())
 
-def on_usernotice_wrapper(connection, event):
-    try:
-        asyncio.run(on_usernotice(connection, event))
-    except Exception as e:
-        logging.error(f"Error handling usernotice {event}: {e}")
-
-async def on_usernotice(connection, event):
-    tags = {tag["key"]: tag["value"] for tag in event.tags}
+async def reauthorise():
+    global token
+    logging.warning("Invalid token or login issue detected. Attempting reauthorization...")
+    token = await bot_loop.run_blocking(autherise, client_id, client_secret)
+    if token:
+        logging.info("Reauthorization successful. Reconnecting...")
+        save_token_to_settings(token)
+        helix.configure(token, client_id, client_secret)
+        reconnect_bot()
+    elif bot:
+        # Closing the client ends run_Twitch_Bot cleanly, so the supervisor leaves it stopped
+        logging.error("Reauthorization failed. Stopping the Twitch bot.")
+        bot.close()
+
+def on_usernotice(connection, event):
+    bot_loop.spawn(handle_usernotice(connection, event))
+
+async def handle_usernotice(connection, event):
+    tags = event.tags
     username = tags.get("login")
     msg_id = tags.get("msg-id")
     tts_message = None  # Initialize early
@@ -141,7 +145,7 @@ async def on_usernotice(connection, event):
 
         if msg_id == "anongiftpaidupgrade":
             tts_message = "Anonymous gifted a sub, thank you very much for the gifted sub!"
-            await text_to_speech(tts_message)
+            await text_to_speech(tts_message, PRIORITY_ALERT)
 
         return
 
@@ -152,30 +156,24 @@ async def on_usernotice(connection, event):
     update_needed = msg_id in {"sub", "resub", "subgift", "giftpaidupgrade"}
 
     # Find existing viewer
-    viewer = next((v for v in viewers if v.username == username), None)
+    viewer = viewers.get(username)
 
     if update_needed:
         if not viewer:
-            threading.Thread(
-                target=new_viewer_wrapper,
-                args=(username, actual_token, client_id, broadcaster_id)
-            ).start()
+            bot_loop.spawn(new_viewer(username))
         else:
-            threading.Thread(target=viewer.update_status).start()
+            bot_loop.spawn(viewer.update_status())
 
     # Handle recipient viewer if it's a subgift
     if msg_id == "subgift":
         recipient = tags.get("msg-param-recipient-user-name")
         if recipient:
             recipient = recipient.lower()
-            recipient_viewer = next((v for v in viewers if v.username == recipient), None)
+            recipient_viewer = viewers.get(recipient)
             if not recipient_viewer:
-                threading.Thread(
-                    target=new_viewer_wrapper,
-                    args=(recipient, actual_token, client_id, broadcaster_id)
-                ).start()
+                bot_loop.spawn(new_viewer(recipient))
             else:
-                threading.Thread(target=recipient_viewer.update_status).start()
+                bot_loop.spawn(recipient_viewer.update_status())
             tts_message = f"{username} gifted a sub to {recipient}, thank you very much for the gifted sub!"
         else:
             tts_message = f"{username} gifted a sub, thank you very much for the gifted sub!"
@@ -185,7 +183,7 @@ async def on_usernotice(connection, event):
 
     elif msg_id == "resub":
         months = tags.get("msg-param-cumulative-months")
-        if months and months.isdigit() and months > 1:
+        if months and months.isdigit() and int(months) > 1:
             months_int = int(months)
             tts_message = f"{username} resubbed for {months_int} months, thank you very much for the sub!"
         else:
@@ -205,7 +203,7 @@ async def on_usernotice(connection, event):
         tts_message = f"{username} gave bits, thank you very much for the bits!"
 
     if tts_message:
-        await text_to_speech(tts_message)
+        await text_to_speech(tts_message, PRIORITY_ALERT, speaker=username)
 
 def save_token_to_settings(new_token):
     if not new_token.startswith("oauth:"):
@@ -219,76 +217,38 @@ def save_token_to_settings(new_token):
     global token
     token = new_token
 
+def create_bot():
+    client = TwitchIRCClient(server, port, nickname, token)
+    client.on('welcome', on_connect)
+    client.on('join', on_join)
+    client.on('part', on_part)
+    client.on('pubmsg', on_pubmsg)
+    client.on('namreply', on_names)
+    client.on('endofnames', on_names)
+    client.on('privnotice', on_privnotice)
+    client.on('usernotice', on_usernotice)
+    client.on('all_events', on_any_event)
+    return client
+
 def reconnect_bot():
-    global bot, irc_thread
-    if bot and bot.connection:
-        try:
-            bot.connection.close()
-            logging.info("Previous connection closed.")
-        except Exception as e:
-            logging.warning(f"Error closing previous connection: {e}")
-    bot = IRCBot(server, port, nickname, token, client_id, client_secret)
-    irc_thread = threading.Thread(target=bot.run, daemon=True)
-    irc_thread.start()
-    logging.info("Reconnection thread started.")
-
-class IRCBot:
-    def __init__(self, server, port, nickname, token, client_id, client_secret):
-        self.server = server
-        self.port = port
-        self.nickname = nickname
-        self.token = token
-        self.client_id = client_id
-        self.client_secret = client_secret
-        self.reactor = irc.client.Reactor()
-        self.connection = None
-
-    def connect(self):
-        factory = irc.connection.Factory(wrapper=ssl.wrap_socket)
-        try:
-            logging.info("Connecting to chat...")
-            token = self.token
-            if not token.startswith("oauth:"):
-                token = f"oauth:{token}"
-            self.connection = self.reactor.server().connect(
-                self.server,
-                self.port,
-                self.nickname,
-                token,
-                connect_factory=factory
-            )
-            logging.info(f"Connected to {self.server} as {self.nickname}")
-        except irc.client.ServerConnectionError as e:
-            logging.error(f"Could not connect to server: {e}")
-
-    def setup_handlers(self):
-        if self.connection:
-            self.connection.add_global_handler('welcome', on_connect)
-            self.connection.add_global_handler('join', on_join)
-            self.connection.add_global_handler('part', on_part)
-            self.connection.add_global_handler('pubmsg', on_pubmsg)
-            self.connection.add_global_handler('namreply', on_names)
-            self.connection.add_global_handler('endofnames', on_names)
-            self.connection.add_global_handler('ping', on_ping)
-            self.connection.add_global_handler('privnotice', on_privnotice)
-            self.connection.add_global_handler('usernotice', on_usernotice)
-            self.connection.add_global_handler('all_events', on_any_event)  # Debug
-
-    def run(self):
-        self.connect()
-        self.setup_handlers()
-        try:
-            self.reactor.process_forever()
-        except KeyboardInterrupt:
-            logging.info("Shutting down...")
-        finally:
-            if self.connection:
-                self.connection.close()
-            logging.info("Bot disconnected.")
-
-def run_Twitch_Bot():
+    """Makes the running chat client log in again with the current token."""
+    if bot:
+        bot.token = token
+        bot.reconnect()
+
+def on_token_refreshed(new_token):
+    """Keeps the IRC credentials in step when the Helix client refreshes the OAuth token."""
+    global token, actual_token
+    token = new_token if new_token.startswith("oauth:") else f"oauth:{new_token}"
+    actual_token = token.split("oauth:")[-1]
+    if bot:
+        bot.token = token  # used the next time it logs in
+
+helix.add_token_listener(on_token_refreshed)
+
+async def run_Twitch_Bot():
     global server, port, settings, client_id, client_secret
-    global token, actual_token, nickname, channel, broadcaster_id
+    global token, actual_token, nickname, channel, broadcaster_id, bot
 
     server = 'irc.chat.twitch.tv'
     port = 6697
@@ -305,7 +265,7 @@ def run_Twitch_Bot():
 
     if not token or not client_id or not client_secret or not nickname:
         logging.warning("Missing Twitch credentials. Attempting to authorize...")
-        token = autherise(client_id, client_secret)
+        token = await bot_loop.run_blocking(autherise, client_id, client_secret)
         if not token:
             logging.error("Could not retrieve Twitch token.")
             return
@@ -314,23 +274,32 @@ def run_Twitch_Bot():
 
     logging.info(f"Bot will join channel: {channel}")
 
-    broadcaster_id = get_broadcaster_id(actual_token, client_id, nickname)
+    helix.configure(token, client_id, client_secret)
+
+    broadcaster_id = await get_broadcaster_id(nickname)
     if broadcaster_id is None:
         logging.warning("Failed to retrieve broadcaster ID. Reauthorizing...")
-        token = autherise(client_id, client_secret)
+        token = await bot_loop.run_blocking(autherise, client_id, client_secret)
         if token:
             save_token_to_settings(token)
             actual_token = token.split("oauth:")[-1]
-            broadcaster_id = get_broadcaster_id(actual_token, client_id, nickname)
+            helix.configure(token, client_id, client_secret)
+            broadcaster_id = await get_broadcaster_id(nickname)
 
     if broadcaster_id is None:
         logging.error("Could not find broadcaster ID after reauthorization.")
         return
 
-    reconnect_bot()
+    channel_roles.configure(broadcaster_id)
+    await channel_roles.start()
 
-    # Run until externally shut down
-    while not shutdown_event.is_set():
-        time.sleep(1)
+    # The client reconnects by itself; this only returns once it is closed
+    client = bot = create_bot()
+    try:
+        await client.run()
+    finally:
+        client.close()
+        if bot is client:
+            bot = None
 
     logging.info("Twitch bot shutting down...")
\ No newline at end of file
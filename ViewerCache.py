@@ -0,0 +1,149 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from BotLoop import bot_loop
+from config import load_settings
+
+settings = load_settings("settings.json")
+Viewer_Cache_Path = settings.get("Viewer_Cache_Path", "viewer_cache.db")
+Viewer_Cache_Follow_TTL = float(settings.get("Viewer_Cache_Follow_TTL", 6 * 60 * 60))
+Viewer_Cache_Sub_TTL = float(settings.get("Viewer_Cache_Sub_TTL", 30 * 60))
+Viewer_Cache_Mod_TTL = float(settings.get("Viewer_Cache_Mod_TTL", 30 * 60))
+
+FIELDS = ("user_id", "following", "subscribed", "mod")
+COLUMNS = ", ".join(f"{field}, {field}_at" for field in FIELDS)
+WRITE_CHUNK = 200  # rows per transaction, so the writer never holds the database for long
+READ_CHUNK = 500   # logins per SELECT, under SQLite's limit on bound parameters
+
+
+class ViewerCache:
+    """
+    SQLite store of viewer status that survives restarts. Each field has its own age limit
+    (a login's user id never expires, follows last hours, sub and mod status less) and expired
+    fields read back as None so only those are fetched from Helix again. Writes are queued and
+    committed in small transactions by a background thread. The database is in WAL mode and every
+    reading thread has its own read-only connection, so reads never wait for a commit; code on the
+    bot loop reads through get_async()/get_many(), which run on the bot's blocking executor.
+    """
+
+    def __init__(self, path, ttls):
+        self.path = path
+        self.ttls = ttls
+        self.hits = 0
+        self.misses = 0
+        self._writes = queue.Queue()
+        self._connection = None  # the writer's; readers use self._local.connection
+        self._local = threading.local()
+
+        if not path:
+            return
+
+        try:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            columns = ", ".join(f"{field}, {field}_at REAL" for field in FIELDS)
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS viewers (login TEXT PRIMARY KEY, {columns})")
+            self._connection.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Could not open viewer cache {path}: {e}")
+            self._connection = None
+            return
+
+        threading.Thread(target=self._write_loop, name="ViewerCacheWriter", daemon=True).start()
+
+    def get(self, login):
+        """Returns a dict of the cached fields for a login, with missing or expired fields set to None. Blocks on the disk."""
+        return self._read([login])[login.lower()]
+
+    async def get_async(self, login):
+        return await bot_loop.run_blocking(self.get, login)
+
+    async def get_many(self, logins):
+        """Like get() for a list of logins, in one executor call. Returns a dict keyed by lowercased login."""
+        return await bot_loop.run_blocking(self._read, logins)
+
+    def put(self, login, **fields):
+        """Queues the given fields (user_id, following, subscribed, mod) to be stored for a login."""
+        fields = {field: value for field, value in fields.items() if field in FIELDS and value is not None}
+        if self._connection and fields:
+            self._writes.put((login.lower(), fields, time.time()))
+
+    def _read(self, logins):
+        logins = list(dict.fromkeys(login.lower() for login in logins))
+        results = {login: dict.fromkeys(FIELDS) for login in logins}
+        connection = self._reader()
+        if connection is None:
+            return results
+
+        rows = {}
+        try:
+            for i in range(0, len(logins), READ_CHUNK):
+                chunk = logins[i:i + READ_CHUNK]
+                query = f"SELECT login, {COLUMNS} FROM viewers WHERE login IN ({', '.join('?' * len(chunk))})"
+                rows.update((row[0], row[1:]) for row in connection.execute(query, chunk))
+        except sqlite3.Error as e:
+            logging.warning(f"Could not read viewer cache for {len(logins)} logins: {e}")
+            return results
+
+        now = time.time()
+        for login, result in results.items():
+            row = rows.get(login)
+            if row is None:
+                self.misses += 1
+                continue
+            for i, field in enumerate(FIELDS):
+                value, stored_at = row[i * 2], row[i * 2 + 1]
+                ttl = self.ttls.get(field)
+                if value is not None and (ttl is None or now - stored_at <= ttl):
+                    result[field] = bool(value) if field != "user_id" else value
+            self.hits += 1
+        return results
+
+    def _reader(self):
+        """This thread's read-only connection, opened on first use."""
+        if not self._connection:
+            return None
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            try:
+                connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            except sqlite3.Error as e:
+                logging.warning(f"Could not open viewer cache {self.path} for reading: {e}")
+                return None
+            self._local.connection = connection
+        return connection
+
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < WRITE_CHUNK:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for login, fields, stored_at in batch:
+                    names = list(fields)
+                    columns = ", ".join(names + [f"{name}_at" for name in names])
+                    updates = ", ".join(f"{name} = excluded.{name}, {name}_at = excluded.{name}_at" for name in names)
+                    values = [fields[name] for name in names] + [stored_at] * len(names)
+                    self._connection.execute(
+                        f"INSERT INTO viewers (login, {columns}) VALUES (?{', ?' * len(values)}) "
+                        f"ON CONFLICT(login) DO UPDATE SET {updates}",
+                        [login] + values
+                    )
+                self._connection.commit()
+            except sqlite3.Error as e:
+                logging.error(f"Could not write {len(batch)} viewers to the cache: {e}")
+
+
+viewer_cache = ViewerCache(Viewer_Cache_Path, {
+    "user_id": None,  # a login's user id doesn't change
+    "following": Viewer_Cache_Follow_TTL,
+    "subscribed": Viewer_Cache_Sub_TTL,
+    "mod": Viewer_Cache_Mod_TTL
+})
@@ -1,138 +1,376 @@
 import logging
-import requests
 import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from HelixClient import helix, HelixError, PRIORITY_BACKGROUND
+from Sampling import IndexedSet, WeightedSet
+from TwitchAPI import user_lookups, channel_roles
+from ViewerCache import viewer_cache
+from config import load_settings
+
+settings = load_settings("settings.json")
+Viewer_Max_Tracked = int(settings.get("Viewer_Max_Tracked", 50000))
+Viewer_Idle_Timeout = float(settings.get("Viewer_Idle_Timeout", 4 * 60 * 60))
+
+# How much a viewer counts for in a weighted raffle
+RAFFLE_WEIGHTS = {
+    "tier": lambda viewer: max(viewer.sub_tier, 1),  # non-subs count like tier 1
+    "activity": lambda viewer: 1 + viewer.messages
+}
+
+
+class ViewerRegistry:
+    """
+    Thread-safe index of the viewers in chat. Viewers are keyed by lowercased username and by
+    Twitch user id, and the usernames of everyone, followers, subscribers and mods are kept in
+    separate indexed sets, so adding, finding and removing a viewer, checking their status or
+    drawing a raffle winner never scans the whole chat.
+
+    PART messages are unreliable in big channels, so viewers are also dropped once they haven't
+    been seen for `idle_timeout` seconds or, least recently seen first, when there are more than
+    `max_viewers`. Their status stays in the viewer cache, so coming back is cheap.
+    """
+
+    def __init__(self, max_viewers=Viewer_Max_Tracked, idle_timeout=Viewer_Idle_Timeout):
+        self.max_viewers = max_viewers
+        self.idle_timeout = idle_timeout
+        self.evicted = 0
+        self._lock = threading.RLock()
+        self._by_name = OrderedDict()  # least recently seen first
+        self._by_id = {}
+        self._ids = {}  # username -> user id it is indexed under
+        self.everyone = IndexedSet()
+        self.followers = IndexedSet()
+        self.subscribers = IndexedSet()
+        self.mods = IndexedSet()
+        # (category, weighting) -> WeightedSet, built on the first weighted draw and kept up to date after
+        self._weighted = {}
+
+    def add(self, viewer):
+        """Adds a viewer. Returns False if a viewer with the same username is already registered."""
+        with self._lock:
+            if viewer.username in self._by_name:
+                return False
+            viewer.last_seen = time.monotonic()
+            self._by_name[viewer.username] = viewer
+            self._index(viewer)
+            self._evict_locked()
+            return True
+
+    def touch(self, username):
+        """Records a chat message from a viewer, keeping them from being evicted."""
+        with self._lock:
+            viewer = self._by_name.get(username)
+            if viewer:
+                viewer.last_seen = time.monotonic()
+                viewer.messages += 1
+                self._by_name.move_to_end(username)
+                for (_, weighting), weighted in self._weighted.items():
+                    if weighting == "activity":
+                        weighted.update(username, RAFFLE_WEIGHTS[weighting](viewer))
+            self._evict_locked()
+
+    def get(self, username):
+        return self._by_name.get(username.strip().lower())
+
+    def get_by_id(self, user_id):
+        return self._by_id.get(user_id)
+
+    def remove(self, username):
+        with self._lock:
+            viewer = self._by_name.pop(username.strip().lower(), None)
+            if viewer:
+                self._unindex(viewer)
+            return viewer
+
+    def refresh(self, viewer):
+        """Re-indexes a viewer after its user id or follower/sub/mod status changed."""
+        with self._lock:
+            if self._by_name.get(viewer.username) is not viewer:
+                return
+            self._unindex(viewer)
+            self._index(viewer)
+
+    def snapshot(self, category=None):
+        """Returns a list of usernames that is safe to use while other threads change the registry."""
+        with self._lock:
+            if category == "followers":
+                return list(self.followers)
+            if category == "subs":
+                return list(self.subscribers)
+            if category == "mods":
+                return list(self.mods)
+            return list(self._by_name)
+
+    def is_mod(self, username):
+        return username.strip().lower() in self.mods
+
+    def draw(self, category=None, exclude=None, weighting=None):
+        """
+        Picks a random username from a category ("followers", "subs", "mods" or everyone), never
+        `exclude`. Uniform unless `weighting` names one of RAFFLE_WEIGHTS. Returns None if nobody
+        is eligible.
+        """
+        exclude = exclude.strip().lower() if exclude else None
+        with self._lock:
+            if weighting is None:
+                return self._pool(category).sample(exclude)
+            return self._weighted_set(category, weighting).sample(exclude)
+
+    def memory_report(self):
+        """Approximate memory held by the registry: viewer records, their strings and the indexes."""
+        with self._lock:
+            viewers = list(self._by_name.values())
+            containers = sum(sys.getsizeof(c) for c in (self._by_name, self._by_id, self._ids, self.everyone,
+                                                        self.followers, self.subscribers, self.mods,
+                                                        *self._weighted.values()))
+        records = sum(sys.getsizeof(viewer) + sys.getsizeof(viewer.username) +
+                      (sys.getsizeof(viewer.user_id) if viewer.user_id else 0) for viewer in viewers)
+        total = containers + records
+        return {
+            "viewers": len(viewers),
+            "evicted": self.evicted,
+            "record_bytes": records,
+            "index_bytes": containers,
+            "total_bytes": total,
+            "bytes_per_viewer": total / len(viewers) if viewers else 0
+        }
 
-viewers = []
+    def _evict_locked(self):
+        # Oldest first, so this stops at the first viewer that may stay
+        cutoff = time.monotonic() - self.idle_timeout if self.idle_timeout > 0 else None
+        while self._by_name:
+            oldest = next(iter(self._by_name.values()))
+            if len(self._by_name) <= self.max_viewers and (cutoff is None or oldest.last_seen >= cutoff):
+                break
+            self._by_name.popitem(last=False)
+            self._unindex(oldest)
+            self.evicted += 1
+
+    def _pool(self, category):
+        return {"followers": self.followers, "subs": self.subscribers, "mods": self.mods}.get(category, self.everyone)
+
+    def _weighted_set(self, category, weighting):
+        # Built in O(n) once per category and weighting; _index, _unindex and touch keep it current
+        weighted = self._weighted.get((category, weighting))
+        if weighted is None:
+            weight = RAFFLE_WEIGHTS[weighting]
+            weighted = self._weighted[(category, weighting)] = WeightedSet()
+            for username in self._pool(category):
+                weighted.add(username, weight(self._by_name[username]))
+        return weighted
+
+    def _index(self, viewer):
+        self.everyone.add(viewer.username)
+        if viewer.user_id:
+            self._by_id[viewer.user_id] = viewer
+            self._ids[viewer.username] = viewer.user_id
+        for members, member in ((self.followers, viewer.following),
+                                (self.subscribers, viewer.subscribed),
+                                (self.mods, viewer.mod)):
+            if member:
+                members.add(viewer.username)
+        for (category, weighting), weighted in self._weighted.items():
+            if viewer.username in self._pool(category):
+                weighted.add(viewer.username, RAFFLE_WEIGHTS[weighting](viewer))
+
+    def _unindex(self, viewer):
+        self.everyone.discard(viewer.username)
+        user_id = self._ids.pop(viewer.username, None)
+        if user_id is not None and self._by_id.get(user_id) is viewer:
+            del self._by_id[user_id]
+        self.followers.discard(viewer.username)
+        self.subscribers.discard(viewer.username)
+        self.mods.discard(viewer.username)
+        for weighted in self._weighted.values():
+            weighted.discard(viewer.username)
+
+    def __contains__(self, username):
+        return username.strip().lower() in self._by_name
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._by_name.values()))
+
+
+viewers = ViewerRegistry()
 
 class Viewer:
-    def __init__(self, username, token, client_id, broadcaster_id):
-        self.username = username.strip().lower()
-        self.token = token
-        self.client_id = client_id
-        self.broadcaster_id = broadcaster_id
-        self.user_id = self.get_user_id_from_username()
-        self.following = self.check_if_follower()
-        self.subscribed = self.check_if_subbed()
-        self.mod = self.check_if_mod()
+    # Credentials and the broadcaster id live in the Helix client and channel_roles, not per viewer
+    __slots__ = ("username", "user_id", "following", "subscribed", "mod", "sub_tier", "messages", "last_seen")
 
+    def __init__(self, username):
+        self.username = username.strip().lower()
+        self.user_id = None
+        self.following = False
+        self.subscribed = False
+        self.mod = False
+        self.sub_tier = 0
+        self.messages = 0
+        self.last_seen = time.monotonic()
+
+    async def load(self, user_lookup=None, cached=None):
+        """
+        Fills in the viewer's id and status from the cache, asking Helix only for what's missing or
+        expired. `user_lookup` is a Future already requested from user_lookups for this login, and
+        `cached` its viewer_cache entry if that has already been read.
+        """
+        cached = cached or await viewer_cache.get_async(self.username)
+        fetched = {}
+
+        self.user_id = cached["user_id"] or fetched.setdefault("user_id", await self.get_user_id_from_username(user_lookup))
+        # Without an id the checks can't run; the status stays unknown (and uncached) until one is found
+        for field, check in (("following", self.check_if_follower), ("subscribed", self.check_if_subbed), ("mod", self.check_if_mod)):
+            value = cached[field]
+            if value is None and self.user_id:
+                value = fetched[field] = await check()
+            setattr(self, field, bool(value))
+        viewer_cache.put(self.username, **fetched)  # fields that couldn't be checked (None) aren't stored
 
         logging.info(f"Initialized viewer: {self.username}")
 
-    def get_headers(self):
-        return {
-            'Authorization': f'Bearer {self.token}',
-            'Client-ID': self.client_id
-        }
-
-    def get_user_id_from_username(self):
-        headers = self.get_headers()
-        response = requests.get(
-            f'https://api.twitch.tv/helix/users?login={self.username}',
-            headers=headers
-        )
+    @classmethod
+    def from_status(cls, username, user_id, following, subscribed, mod):
+        """Creates a viewer whose status is already known, without calling the Twitch API."""
+        viewer = cls(username)
+        viewer.user_id = user_id
+        viewer.following = following
+        viewer.subscribed = subscribed
+        viewer.mod = mod
+        return viewer
+
+    async def get_user_id_from_username(self, user_lookup=None):
         try:
-            user_data = response.json()
+            # Batched with other lookups made around the same time, up to 100 logins per request
+            user_lookup = user_lookup or user_lookups.lookup(self.username)
+            # Shielded: the Future is shared with the rest of the batch, so timing out mustn't cancel it
+            user = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(user_lookup)), timeout=30)
         except Exception as e:
-            logging.error(f"Error decoding Twitch response: {e}")
+            logging.error(f"Error looking up Twitch user {self.username}: {e}")
             return None
 
-        logging.debug(f"User data response for {self.username}: {user_data}")
-
-        if response.status_code == 200 and 'data' in user_data and user_data['data']:
-            user_id = user_data['data'][0]['id']
+        if user:
+            user_id = user['id']
             logging.info(f"User ID for {self.username} is {user_id}")
             return user_id
         else:
-            message = user_data.get('message', 'No message')
-            logging.warning(f"Could not find user {self.username}. Status: {response.status_code}, Message: {message}")
+            logging.warning(f"Could not find user {self.username}.")
             return None
 
-    def check_if_follower(self):
-        logging.info(f"Checking if {self.username} is following {self.broadcaster_id}")
+    async def check_if_follower(self):
+        logging.info(f"Checking if {self.username} is following {channel_roles.broadcaster_id}")
 
         if not self.user_id:
             logging.error(f"User {self.username} has no ID")
-            return False
+            return None  # unknown, so nothing gets cached
 
-        headers = self.get_headers()
-        follows_url = f'https://api.twitch.tv/helix/channels/followers?broadcaster_id={self.broadcaster_id}&user_id={self.user_id}'
-        response = requests.get(follows_url, headers=headers)
+        known = channel_roles.is_follower(self.user_id)
+        if known is not None:
+            return known
 
-        logging.info(f"Follower API response: {response.status_code} - {response.text}")
+        try:
+            response = await helix.get("/channels/followers", params={"broadcaster_id": channel_roles.broadcaster_id, "user_id": self.user_id}, priority=PRIORITY_BACKGROUND)
+        except HelixError as e:
+            # Unknown rather than False, so the failure isn't cached as "not following"
+            logging.error(f"Error checking if {self.username} is following: {e}")
+            return None
 
-        if response.status_code == 400:
-            logging.error(f"Bad Request: {response.text}")
+        logging.info(f"Follower API response: {response.status} - {response.data}")
+
+        if response.status == 400:
+            logging.error(f"Bad Request: {response.data}")
             return False
 
-        elif response.status_code == 401:
+        elif response.status == 401:
             logging.error("Unauthorized access. Missing scope: user:read:follows")
             return False
 
-        elif response.status_code == 200:
+        elif response.status == 200:
             data = response.json().get("data", [])
             if data:
-                logging.info(f"{self.username} **is** following {self.broadcaster_id}")
+                logging.info(f"{self.username} **is** following {channel_roles.broadcaster_id}")
                 return True
             else:
-                logging.info(f"{self.username} **is NOT** following {self.broadcaster_id}")
+                logging.info(f"{self.username} **is NOT** following {channel_roles.broadcaster_id}")
                 return False
 
-    def check_if_subbed(self):
+        return False
+
+    async def check_if_subbed(self):
         logging.info(f"Checking if {self.username} is subbed")
 
         if not self.user_id:
             logging.error(f"User {self.username} has no ID")
-            return False
+            return None  # unknown, so nothing gets cached
 
-        headers = self.get_headers()
-        subs_url = f"https://api.twitch.tv/helix/subscriptions?broadcaster_id={self.broadcaster_id}&user_id={self.user_id}"
-        response = requests.get(subs_url, headers=headers)
+        known = channel_roles.is_subscriber(self.user_id)
+        if known is not None:
+            self.sub_tier = channel_roles.sub_tier(self.user_id) or 0
+            return known
 
-        logging.info(f"Subscription API response: {response.status_code} - {response.text}")
+        try:
+            response = await helix.get("/subscriptions", params={"broadcaster_id": channel_roles.broadcaster_id, "user_id": self.user_id}, priority=PRIORITY_BACKGROUND)
+        except HelixError as e:
+            logging.error(f"Error checking if {self.username} is subbed: {e}")
+            return None
 
-        if response.status_code == 200:
+        logging.info(f"Subscription API response: {response.status} - {response.data}")
+
+        if response.status == 200:
             data = response.json().get("data", [])
             if data:
-                logging.info(f"User {self.username} **is** subscribed to {self.broadcaster_id}")
+                logging.info(f"User {self.username} **is** subscribed to {channel_roles.broadcaster_id}")
+                self.sub_tier = int(data[0].get("tier", "1000")) // 1000
                 return True
             else:
-                logging.info(f"User {self.username} **is NOT** subscribed to {self.broadcaster_id}")
+                logging.info(f"User {self.username} **is NOT** subscribed to {channel_roles.broadcaster_id}")
+                self.sub_tier = 0
                 return False
 
-        elif response.status_code == 401:
+        elif response.status == 401:
             logging.error("Unauthorized access. Missing scope: channel:read:subscriptions")
             return False
 
         else:
-            logging.warning(f"Unexpected response: {response.status_code} - {response.text}")
+            logging.warning(f"Unexpected response: {response.status} - {response.data}")
             return False
 
-    def check_if_mod(self):
+    async def check_if_mod(self):
         logging.info(f"Checking if {self.username} is a mod")
 
         if not self.user_id:
             logging.error(f"User {self.username} has no ID")
-            return False
+            return None  # unknown, so nothing gets cached
 
         # Viewer is the broadcaster — always has mod-level access
-        if self.user_id == self.broadcaster_id:
+        if self.user_id == channel_roles.broadcaster_id:
             logging.info(f"{self.username} **is** the broadcaster — treated as mod")
             return True
 
-        headers = self.get_headers()
-        url = (
-            f"https://api.twitch.tv/helix/moderation/moderators"
-            f"?broadcaster_id={self.broadcaster_id}&user_id={self.user_id}"
-        )
-        response = requests.get(url, headers=headers)
+        known = channel_roles.is_moderator(self.user_id)
+        if known is not None:
+            return known
 
-        logging.info(f"Moderator API response: {response.status_code} - {response.text}")
+        try:
+            response = await helix.get("/moderation/moderators", params={"broadcaster_id": channel_roles.broadcaster_id, "user_id": self.user_id}, priority=PRIORITY_BACKGROUND)
+        except HelixError as e:
+            logging.error(f"Error checking if {self.username} is a mod: {e}")
+            return None
+
+        logging.info(f"Moderator API response: {response.status} - {response.data}")
 
-        if response.status_code == 401:
+        if response.status == 401:
             logging.error("Unauthorized access. Missing scope: moderator:read:chatters")
             return False
 
-        elif response.status_code == 200:
+        elif response.status == 200:
             data = response.json().get("data", [])
             if any(entry["user_id"] == self.user_id for entry in data):
                 logging.info(f"{self.username} **is** a moderator")
@@ -142,69 +380,282 @@ class Viewer:
                 return False
 
         else:
-            logging.warning(f"Unexpected response when checking mod status: {response.status_code}")
+            logging.warning(f"Unexpected response when checking mod status: {response.status}")
             return False
 
-        def update_status(self):
-            self.following = self.check_if_follower()
-            self.subscribed = self.check_if_subbed()
-            self.mod = self.check_if_mod()
-            logging.info(f"Updated status for {self.username} — Follower: {self.following}, Sub: {self.subscribed}, Mod: {self.mod}")
+    async def update_status(self):
+        following, subscribed, mod = await asyncio.gather(
+            self.check_if_follower(), self.check_if_subbed(), self.check_if_mod())
+        # Keep the previous value of anything that couldn't be checked
+        self.following = self.following if following is None else following
+        self.subscribed = self.subscribed if subscribed is None else subscribed
+        self.mod = self.mod if mod is None else mod
+        viewers.refresh(self)
+        viewer_cache.put(self.username, following=following, subscribed=subscribed, mod=mod)
+        logging.info(f"Updated status for {self.username} — Follower: {self.following}, Sub: {self.subscribed}, Mod: {self.mod}")
+
+    async def update_following(self):
+        following = await self.check_if_follower()
+        if following is not None:
+            self.following = following
+            viewers.refresh(self)
+            viewer_cache.put(self.username, following=following)
+
+
+class InFlightLookups:
+    """
+    Single-flight map of viewer lookups in progress. The first caller for a login claims it and
+    does the Helix calls; anyone asking for the same login meanwhile gets the same Future and waits
+    for that result instead of starting another lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # username -> Future resolving to the Viewer
+        self.started = 0
+        self.deduplicated = 0
+
+    def claim(self, username):
+        """Returns (future, owner). Only the owner should do the lookup and then call release()."""
+        with self._lock:
+            future = self._pending.get(username)
+            if future is not None:
+                self.deduplicated += 1
+                return future, False
+            future = self._pending[username] = Future()
+            self.started += 1
+            return future, True
+
+    def release(self, username):
+        with self._lock:
+            self._pending.pop(username, None)
+
+    def __contains__(self, username):
+        return username.strip().lower() in self._pending
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._pending), "started": self.started, "deduplicated": self.deduplicated}
+
+
+viewer_lookups = InFlightLookups()
+
+
+async def new_viewer(username, user_lookup=None, cached=None):
+    username = username.strip().lower()
+    if username in viewers:
+        logging.info(f"{username} already exists in the viewer list.")
+        return viewers.get(username)
 
+    future, owner = viewer_lookups.claim(username)
+    if not owner:
+        logging.info(f"Lookup for {username} already in progress, waiting for it")
+        # Shielded so a waiter that is cancelled doesn't cancel the shared lookup for everyone else
+        return await asyncio.shield(asyncio.wrap_future(future))
 
-async def new_viewer(username, token, client_id, broadcaster_id):
-    username_lower = username.lower()
+    try:
+        # The previous owner may have finished between the check above and the claim
+        viewer = viewers.get(username)
+        if viewer is None:
+            viewer = Viewer(username)
+            await viewer.load(user_lookup, cached)
+            if viewers.add(viewer):
+                logging.info(f"Added viewer: {viewer.username} ({len(viewers)} viewers)")
+            else:
+                viewer = viewers.get(username)  # registered meanwhile from chat tags
+        if not future.done():
+            future.set_result(viewer)
+        return viewer
+    except BaseException as e:
+        # Includes the owner being cancelled, which would otherwise leave every waiter hanging
+        if not future.done():
+            future.set_exception(e)
+        raise
+    finally:
+        # Released only after the viewer is registered, so later callers find it in `viewers`
+        viewer_lookups.release(username)
+
+
+def parse_badges(badges):
+    """Parses a `badges` IRC tag ("broadcaster/1,subscriber/12") into a dict of badge name to version."""
+    if not badges:
+        return {}
+    return dict(badge.partition("/")[::2] for badge in badges.split(","))
+
+
+def sub_tier_from_badges(badges):
+    """Sub tier from the subscriber badge version, which is the months subscribed plus 2000 or 3000 for tiers 2 and 3."""
+    version = badges.get("subscriber", "")
+    if version.isdigit():
+        return 3 if int(version) >= 3000 else 2 if int(version) >= 2000 else 1
+    return 1 if "founder" in badges else 0
+
+
+async def apply_chat_tags(username, tags):
+    """
+    Records the user id, sub and mod status carried by a chat message's IRC tags, creating the
+    viewer if needed. Returns the viewer and whether their follower status still has to be looked
+    up, which is the only thing the tags don't say.
+    """
+    badges = parse_badges(tags.get("badges"))
+    user_id = tags.get("user-id") or None
+    subscribed = tags.get("subscriber") == "1" or "subscriber" in badges or "founder" in badges
+    mod = tags.get("mod") == "1" or "broadcaster" in badges or "moderator" in badges
+    sub_tier = (sub_tier_from_badges(badges) or 1) if subscribed else 0
+
+    viewer = viewers.get(username)
+    if viewer is None:
+        following = (await viewer_cache.get_async(username))["following"]
+        if following is None:
+            following = channel_roles.is_follower(user_id)
+        created = Viewer.from_status(username, user_id, bool(following), subscribed, mod)
+        created.sub_tier = sub_tier
+        created.messages = 1
+        if viewers.add(created):
+            logging.info(f"Added viewer from chat tags: {created.username} ({len(viewers)} viewers)")
+            viewer_cache.put(username, user_id=user_id, subscribed=subscribed, mod=mod)
+            return created, following is None
+        viewer = viewers.get(username)  # added by another thread meanwhile
+    else:
+        viewers.touch(username)
 
-    if any(viewer.username == username_lower for viewer in viewers):
-        logging.info(f"{username} already exists in the viewer list.")
-        return
+    # Follow status couldn't be checked while the viewer had no user id
+    needs_follow_check = viewer.user_id is None and user_id is not None
 
-    viewer = Viewer(username=username, token=token, client_id=client_id, broadcaster_id=broadcaster_id)
-    viewers.append(viewer)
-    logging.info(f"Added viewer: {viewer.username}")
-    logging.info(f"Updated list of viewers: {[v.username for v in viewers]}")
+    # Most messages come from viewers whose status hasn't changed, so only write when it has
+    if (viewer.user_id, viewer.subscribed, viewer.mod, viewer.sub_tier) != (user_id or viewer.user_id, subscribed, mod, sub_tier):
+        viewer.user_id = user_id or viewer.user_id
+        viewer.subscribed = subscribed
+        viewer.mod = mod
+        viewer.sub_tier = sub_tier
+        viewers.refresh(viewer)
+        viewer_cache.put(username, user_id=user_id, subscribed=subscribed, mod=mod)
+    return viewer, needs_follow_check
 
 
-def new_viewer_wrapper(username, token, client_id, broadcaster_id):
-    try:
-        asyncio.run(new_viewer(username, token, client_id, broadcaster_id))
-    except Exception as e:
-        logging.error(f"Error handling message from {username}: {e}")
+def apply_channel_roles(roles):
+    """Updates every tracked viewer from freshly loaded channel role lists."""
+    for viewer in viewers:
+        following = roles.is_follower(viewer.user_id)
+        subscribed = roles.is_subscriber(viewer.user_id)
+        mod = roles.is_moderator(viewer.user_id)
+        status = (viewer.following if following is None else following,
+                  viewer.subscribed if subscribed is None else subscribed,
+                  viewer.mod if mod is None else mod,
+                  viewer.sub_tier if subscribed is None else roles.sub_tier(viewer.user_id) or 0)
 
+        # Most viewers are unchanged between refreshes, so only re-index and write the ones that aren't
+        if status != (viewer.following, viewer.subscribed, viewer.mod, viewer.sub_tier):
+            viewer.following, viewer.subscribed, viewer.mod, viewer.sub_tier = status
+            viewers.refresh(viewer)
+            viewer_cache.put(viewer.username, following=following, subscribed=subscribed, mod=mod)
 
-def remove_viewer(username):
-    username_lower = username.lower()
-    viewer_to_remove = next((v for v in viewers if v.username == username_lower), None)
 
-    if viewer_to_remove:
-        viewers.remove(viewer_to_remove)
-        logging.info(f"Removed viewer: {username}")
+channel_roles.add_listener(apply_channel_roles)
+
+
+async def new_viewers(usernames):
+    """Adds a burst of viewers (e.g. a NAMES reply) concurrently, resolving their user ids in batches."""
+    usernames = [username for username in usernames if username not in viewers]
+    cached = await viewer_cache.get_many(usernames)  # one trip to the executor for the whole burst
+    # Queued together so they go out in full batches; each viewer then waits on its own Future
+    lookups = user_lookups.lookup_many([username for username in usernames if cached[username.lower()]["user_id"] is None])
+
+    results = await asyncio.gather(*(new_viewer(username, lookups.get(username), cached[username.lower()])
+                                     for username in usernames), return_exceptions=True)
+    for username, result in zip(usernames, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error adding viewer {username}: {result}")
+
+    logging.info(f"Added {len(usernames)} viewers from NAMES. User lookups: {user_lookups.stats()}, "
+                 f"viewer lookups: {viewer_lookups.stats()}")
+
+
+def remove_viewer(username):
+    if viewers.remove(username):
+        logging.info(f"Removed viewer: {username} ({len(viewers)} viewers)")
     else:
         logging.info(f"{username} was not found in the viewers list.")
 
-    logging.info(f"Updated list of viewers: {[v.username for v in viewers]}")
-
 
-def get_broadcaster_id(token, client_id, username):
+async def get_broadcaster_id(username):
     logging.info(f"Getting broadcaster_id for {username}")
-    token = token.replace("oauth:", "").strip()
 
-    headers = {
-        'Authorization': f'Bearer {token}',
-        'Client-ID': client_id
-    }
-
-    response = requests.get(f'https://api.twitch.tv/helix/users?login={username}', headers=headers)
     try:
-        user_data = response.json()
-    except Exception as e:
-        logging.warning(f"Failed to parse Twitch user response: {e}")
+        response = await helix.get("/users", params={"login": username})
+    except HelixError as e:
+        logging.warning(f"Failed to retrieve broadcaster ID: {e}")
         return None
 
-    if response.status_code == 200 and 'data' in user_data and user_data['data']:
+    user_data = response.json()
+    if response.status == 200 and user_data.get('data'):
         broadcaster_id = user_data['data'][0]['id']
         logging.info(f"Successfully retrieved broadcaster ID for {username}: {broadcaster_id}")
         return broadcaster_id
     else:
         logging.warning(f"Failed to retrieve broadcaster ID. Error: {user_data.get('message', 'Unknown error')}")
         return None
+
+if __name__ == '__main__':
+    import tracemalloc
+
+    # Join/lookup/leave cost with a very large chat
+    count = 100000
+    registry = ViewerRegistry(max_viewers=count, idle_timeout=0)
+    batch = [Viewer.from_status(f"viewer{i}", str(i), i % 3 == 0, i % 10 == 0, i % 100 == 0) for i in range(count)]
+
+    started = time.perf_counter()
+    for viewer in batch:
+        registry.add(viewer)
+    joined = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(count):
+        registry.get(f"viewer{i}")
+        registry.is_mod(f"viewer{i}")
+        registry.touch(f"viewer{i}")
+    looked_up = time.perf_counter() - started
+
+    draws = 10000
+    started = time.perf_counter()
+    for i in range(draws):
+        registry.draw("subs", exclude=f"viewer{i}")
+    uniform = time.perf_counter() - started
+    registry.draw("subs", weighting="activity")  # builds the weighted sets
+    registry.draw(None, weighting="tier")
+
+    # Live chat: every draw is mixed in with chat messages and joins/parts that change the weights
+    started = time.perf_counter()
+    for i in range(draws):
+        registry.touch(f"viewer{(i * 7919) % count}")
+        registry.touch(f"viewer{(i * 104729) % count}")
+        if i % 10 == 0:
+            registry.refresh(batch[(i * 31) % count])
+        registry.draw("subs", exclude=f"viewer{i}", weighting="activity")
+        registry.draw(None, exclude=f"viewer{i}", weighting="tier")
+    weighted = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for viewer in batch:
+        registry.remove(viewer.username)
+    left = time.perf_counter() - started
+
+    print(f"{count} viewers: join {joined / count * 1e6:.2f} us, lookup+touch {looked_up / count * 1e6:.2f} us, "
+          f"leave {left / count * 1e6:.2f} us per viewer")
+    print(f"Raffle draws: uniform {uniform / draws * 1e6:.2f} us, two weighted draws with two touches and "
+          f"0.1 re-indexes between them {weighted / draws * 1e6:.2f} us")
+
+    # Memory of a full registry, records and indexes included
+    tracemalloc.start()
+    registry = ViewerRegistry(max_viewers=count, idle_timeout=0)
+    for i in range(count):
+        registry.add(Viewer.from_status(f"viewer{i}", str(i), i % 3 == 0, i % 10 == 0, i % 100 == 0))
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Memory: {traced / count:.0f} bytes per viewer traced, report {registry.memory_report()}")
+
+    # Eviction keeps the registry at its cap
+    registry = ViewerRegistry(max_viewers=1000, idle_timeout=0)
+    for viewer in batch:
+        registry.add(viewer)
+    print(f"Capped at 1000: {len(registry)} viewers kept, {registry.evicted} evicted")
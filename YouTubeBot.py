@@ -1,5 +1,5 @@
 import logging
-import threading
+import inspect
 import time
 import json
 import asyncio
@@ -9,10 +9,11 @@ from BotTTS import text_to_speech
 from Commands import COMMANDS, VoteCommand
 from SoundEffect import play_sound_from_file
 from config import process_settings, sound_effects
-from Viewers import viewers, new_viewer_wrapper, remove_viewer
 from Autherisation_URL import authenticate_youtube
+from BotLoop import bot_loop
+from ChatWorkers import chat_workers
+from Supervisor import supervisor, shutdown_event
 
-shutdown_event = threading.Event()
 live_chat_id = None
 youtube = None
 
@@ -31,37 +32,35 @@ def get_live_chat_id(youtube, channel_id):
         return None
     return items[0]['snippet']['liveChatId']
 
-def poll_chat_messages():
+async def poll_chat_messages():
     global youtube, live_chat_id
 
     next_page_token = None
     while not shutdown_event.is_set():
         try:
-            response = youtube.liveChatMessages().list(
+            # The Google client is blocking, so each poll runs on the bot's executor
+            request = youtube.liveChatMessages().list(
                 liveChatId=live_chat_id,
                 part='snippet,authorDetails',
                 pageToken=next_page_token
-            ).execute()
+            )
+            response = await bot_loop.run_blocking(request.execute)
+            supervisor.heartbeat("YouTubeBot")
 
             for message in response.get("items", []):
                 author = message["authorDetails"]["displayName"]
                 text = message["snippet"]["displayMessage"]
                 logging.info(f"[YouTube Chat] {author}: {text}")
-                threading.Thread(target=handle_chat_message_wrapper, args=(author, text)).start()
+                # Waits for room when the pool is saturated, which slows the next poll down
+                await chat_workers.put(author, handle_chat_message, author, text)
 
             next_page_token = response.get("nextPageToken")
             polling_interval = float(response.get("pollingIntervalMillis", 2000)) / 1000.0
-            time.sleep(polling_interval)
+            await asyncio.sleep(polling_interval)
 
         except Exception as e:
             logging.error(f"Error polling chat: {e}")
-            time.sleep(5)
-
-def handle_chat_message_wrapper(username, message):
-    try:
-        asyncio.run(handle_chat_message(username, message))
-    except Exception as e:
-        logging.error(f"Error in message handler: {e}")
+            await asyncio.sleep(5)
 
 async def handle_chat_message(username, message):
     try:
@@ -69,11 +68,13 @@ async def handle_chat_message(username, message):
         command = COMMANDS.get(command_name)
 
         if command:
-            await command.execute(None, username, message, "YouTube", "", "", "")
+            result = command.execute(None, username, message, "YouTube", "", "", "")
+            if inspect.isawaitable(result):
+                await result
             return
 
         if message.lower() == "get out":
-            play_sound_from_file(sound_effects, "Tuco-GET-OUT-Sound-Effect.mp3", True)
+            await bot_loop.run_blocking(play_sound_from_file, sound_effects, "Tuco-GET-OUT-Sound-Effect.mp3", True)
             return
 
         if VoteCommand.vote_is_active:
@@ -90,7 +91,7 @@ async def handle_chat_message(username, message):
     except Exception as e:
         logging.error(f"Error processing message: {e}")
 
-def run_YouTube_Bot():
+async def run_YouTube_Bot():
     global youtube, live_chat_id
 
     settings = process_settings("settings.json")
@@ -104,21 +105,21 @@ def run_YouTube_Bot():
         return
 
     # Authenticate and get a valid access token
-    access_token = authenticate_youtube(client_id, client_secret)
+    access_token = await bot_loop.run_blocking(authenticate_youtube, client_id, client_secret)
 
     if not access_token:
         logging.error("YouTube authentication failed. Bot will not run.")
         return
 
     # Build the YouTube API client using developerKey (for public APIs)
-    youtube = build('youtube', 'v3', developerKey=api_key)
+    youtube = await bot_loop.run_blocking(build, 'youtube', 'v3', developerKey=api_key)
 
-    live_chat_id = get_live_chat_id(youtube, channel_id)
+    live_chat_id = await bot_loop.run_blocking(get_live_chat_id, youtube, channel_id)
     if not live_chat_id:
         logging.error("Could not retrieve Live Chat ID. Ensure you're live.")
         return
 
     logging.info("YouTube bot is now connected to live chat.")
-    poll_chat_messages()
+    await poll_chat_messages()
 
     logging.info("YouTube bot shutting down.")
\ No newline at end of file